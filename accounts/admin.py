@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import CustomUser, LinkTenantLandlord, LinkRequest, OfflineTenants, Billing, LandlordRequest
+from .ledger import recompute_following
+from .models import CustomUser, LinkTenantLandlord, LinkRequest, OfflineTenants, Billing, LandlordRequest, LoginFailure, MediaBlob, ScheduledJob, ScheduledJobRun
 
 
 @admin.register(CustomUser)
@@ -80,6 +81,12 @@ class BillingAdmin(admin.ModelAdmin):
         return "-"
     get_tenant.short_description = "Tenant"  # Column header in admin
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Edits ripple into the meter readings and dues of later bills
+        if change:
+            recompute_following(obj)
+
 
 
 @admin.register(LandlordRequest)
@@ -93,4 +100,27 @@ class LandlordRequestAdmin(admin.ModelAdmin):
         # if approved, update user role
         if obj.status == 'approved':
             obj.user.role = 'landlord'
-            obj.user.save()
+            obj.user.save(update_fields=['role'])
+
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_success_date', 'lease_owner', 'lease_expires_at', 'updated_at')
+
+
+@admin.register(ScheduledJobRun)
+class ScheduledJobRunAdmin(admin.ModelAdmin):
+    list_display = ('job', 'owner', 'started_at', 'finished_at', 'rows_created', 'error')
+    list_filter = ('job',)
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refs', 'updated_at')
+    search_fields = ('name',)
+
+
+@admin.register(LoginFailure)
+class LoginFailureAdmin(admin.ModelAdmin):
+    list_display = ('key', 'failures', 'expires_at')
+    search_fields = ('key',)
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Q
+
+
+class UsernameOrPhoneBackend(ModelBackend):
+    """
+    Log in with either the username or the phone number, resolved in one
+    query. A username match wins if another account uses that string as
+    its phone number.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        candidates = list(UserModel._default_manager.filter(Q(username=username) | Q(phone_number=username))[:2])
+        user = next((u for u in candidates if u.username == username), candidates[0] if candidates else None)
+
+        if user is None:
+            # Hash anyway so a missing account takes as long as a wrong password
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,99 @@
+from datetime import date
+from django.db.models import Count, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from .models import Billing
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def bills_for(user, tenant_filter=""):
+    """Bills visible to `user`, newest period first, with tenant rows joined in."""
+    if user.role == "landlord":
+        bills = Billing.objects.filter(
+            Q(offline_tenant__landlord=user) | Q(online_tenant__landlord=user)
+        )
+        # Optional filter by tenant name
+        if tenant_filter:
+            bills = bills.filter(
+                Q(offline_tenant__name__icontains=tenant_filter) |
+                Q(online_tenant__tenant__username__icontains=tenant_filter)
+            )
+    elif user.role == "tenant":
+        # Only show bills linked to this tenant
+        bills = Billing.objects.filter(online_tenant__tenant=user)
+    else:
+        bills = Billing.objects.none()
+
+    return with_amounts(bills).select_related(
+        'offline_tenant', 'online_tenant__tenant'
+    ).order_by('-start_date', '-id')
+
+
+def with_amounts(bills):
+    """Annotate the SQL equivalents of Billing.meter_bill, total_bill_amount and remaining_due."""
+    consumption = Coalesce(
+        Greatest(F('current_meter_reading') - F('previous_meter_reading'), Value(0)), 0
+    )
+    meter_amount = consumption * Coalesce(F('meter_rate'), 0)
+    total = (
+        Coalesce(F('rent'), 0) + Coalesce(F('previous_due_amount'), 0)
+        + meter_amount + Coalesce(F('misc_charge'), 0)
+    )
+    return bills.annotate(
+        meter_amount=meter_amount,
+        bill_total=total,
+        bill_remaining=total - Coalesce(F('amount_paid'), 0),
+    )
+
+
+def bill_totals(bills):
+    """Header-row totals for a with_amounts() queryset, in one aggregate query."""
+    totals = bills.order_by().aggregate(
+        count=Count('id'),
+        rent=Sum('rent'),
+        meter_bill=Sum('meter_amount'),
+        misc_charge=Sum('misc_charge'),
+        total=Sum('bill_total', output_field=IntegerField()),
+        amount_paid=Sum('amount_paid'),
+        remaining=Sum('bill_remaining', output_field=IntegerField()),
+    )
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def encode_cursor(bill):
+    return f"{bill.start_date.isoformat()}_{bill.id}"
+
+
+def decode_cursor(cursor):
+    """Parse 'YYYY-MM-DD_id'; returns None for a missing or malformed cursor."""
+    try:
+        start, bill_id = cursor.split("_", 1)
+        return date.fromisoformat(start), int(bill_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_page(bills, cursor=None, page_size=PAGE_SIZE):
+    """
+    One page of a ('-start_date', '-id') ordered queryset, seeking past `cursor`.
+
+    Returns (bills, next_cursor); next_cursor is None on the last page.
+    """
+    position = decode_cursor(cursor)
+    if position:
+        start, bill_id = position
+        bills = bills.filter(Q(start_date__lt=start) | Q(start_date=start, id__lt=bill_id))
+
+    page = list(bills[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+    return page, None
+
+
+def page_size_from(value):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return PAGE_SIZE
@@ -1,6 +1,19 @@
 from django.shortcuts import redirect
 from functools import wraps
 
+# Where each role lands after login and when it opens another role's page
+ROLE_DASHBOARDS = {
+    'guest': 'guest_dashboard',
+    'landlord': 'landlord_dashboard',
+    'tenant': 'tenant_dashboard',
+}
+
+
+def dashboard_for(user):
+    """URL name of the user's own dashboard, so callers can redirect there in one hop."""
+    return ROLE_DASHBOARDS.get(user.role, 'home')
+
+
 def role_required(required_role):
     """General purpose decorator for checking user role, superusers bypass"""
     def decorator(view_func):
@@ -13,17 +26,9 @@ def role_required(required_role):
             if request.user.is_superuser:
                 return view_func(request, *args, **kwargs)
 
-            # Role check
+            # Role check: send them straight to their correct dashboard
             if request.user.role != required_role:
-                # Redirect them to their correct dashboard
-                if request.user.role == 'tenant':
-                    return redirect('tenant_dashboard')
-                elif request.user.role == 'landlord':
-                    return redirect('landlord_dashboard')
-                elif request.user.role == 'guest':
-                    return redirect('guest_dashboard')
-                else:
-                    return redirect('home')  # fallback
+                return redirect(dashboard_for(request.user))
 
             return view_func(request, *args, **kwargs)
         return _wrapped_view
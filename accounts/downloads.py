@@ -0,0 +1,112 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, content_disposition_header
+from .storage import BLOB_DIR
+
+# Optional hand-off to a front server: "X-Sendfile" (Apache, lighttpd) or
+# "X-Accel-Redirect" (nginx, which needs SENDFILE_URL_PREFIX for the internal location)
+SENDFILE_HEADER = getattr(settings, "SENDFILE_HEADER", None)
+SENDFILE_URL_PREFIX = getattr(settings, "SENDFILE_URL_PREFIX", "/protected-media/")
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_etag(name, stat):
+    """Strong ETag: the content hash for content-addressed blobs, else size and mtime."""
+    if name.startswith(f"{BLOB_DIR}/"):
+        return '"%s"' % os.path.splitext(os.path.basename(name))[0]
+    return '"%x-%x"' % (stat.st_size, int(stat.st_mtime))
+
+
+def byte_range(header, size):
+    """
+    (start, end) inclusive for a single "bytes=" range, None to send the
+    whole file (no header, several ranges, or a form we don't handle), or
+    False when the range cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:  # "bytes=-N": the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_span(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, storage, name, filename, as_attachment=False):
+    """
+    Send a stored file after the caller has checked permissions.
+
+    Answers If-None-Match / If-Modified-Since with 304 and a single byte
+    Range (honouring If-Range) with 206, so interrupted downloads resume.
+    Whole files go out as a FileResponse, which WSGI servers hand to
+    sendfile(); with SENDFILE_HEADER set the front server sends them instead.
+    """
+    path = storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:  # the row outlived its file (restored backup, manual cleanup)
+        raise Http404("The file is missing.")
+    etag = file_etag(name, stat)
+    last_modified = int(stat.st_mtime)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    content_type = mimetypes.guess_type(filename)[0] or mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    span = byte_range(request.headers.get("Range"), stat.st_size)
+    if_range = request.headers.get("If-Range")
+    if span is not None and if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        # The client's partial copy is stale: send the current file whole, even
+        # when its range no longer fits (RFC 9110 section 13.1.5)
+        span = None
+
+    if span is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+    elif SENDFILE_HEADER:
+        response = HttpResponse(content_type=content_type)
+        if SENDFILE_HEADER.lower() == "x-accel-redirect":
+            response[SENDFILE_HEADER] = SENDFILE_URL_PREFIX + name
+        else:
+            response[SENDFILE_HEADER] = path
+    elif span:
+        start, end = span
+        response = StreamingHttpResponse(
+            _read_span(path, start, end - start + 1), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Content-Disposition"] = content_disposition_header(as_attachment, filename)
+    # Permission-checked, so never in shared caches; revalidation is a cheap 304
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -5,6 +5,7 @@ from django.contrib.auth import authenticate
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import PasswordChangeForm
 from .models import LinkTenantLandlord
+from .throttle import clear_login_failures, login_blocked, record_login_failure
 
 
 
@@ -65,25 +66,18 @@ class CustomLogin(AuthenticationForm):
         if not username_input or not password:
             raise forms.ValidationError("Please enter both username/phone and password.")
 
-        # Try to find user by username
-        user_obj = CustomUser.objects.filter(username=username_input).first()
-        if not user_obj:
-            # Try by phone number
-            user_obj = CustomUser.objects.filter(phone_number=username_input).first()
+        # Refuse before hashing anything once the IP or account is locked out
+        if login_blocked(self.request, username_input):
+            raise forms.ValidationError("Too many failed login attempts. Please try again later.")
 
-        if not user_obj:
-            raise forms.ValidationError("Invalid username or phone number.")
-
-        # Authenticate with the actual username
-        self.user_cache = authenticate(
-            self.request,
-            username=user_obj.username,
-            password=password
-        )
+        # UsernameOrPhoneBackend matches username or phone number in one query
+        self.user_cache = authenticate(self.request, username=username_input, password=password)
 
         if self.user_cache is None:
+            record_login_failure(self.request, username_input)
             raise forms.ValidationError("Invalid login credentials.")
 
+        clear_login_failures(self.request, username_input)
         return self.cleaned_data
 
     def get_user(self):
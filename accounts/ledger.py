@@ -0,0 +1,133 @@
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from .models import Billing, TenancyBalance
+
+# Columns a ledger recompute may change on a downstream bill
+LEDGER_FIELDS = [
+    'previous_meter_reading', 'current_meter_reading', 'previous_due_amount',
+    'total_amount', 'remaining_due_amount', 'status', 'updated_at',
+]
+
+
+def later_bills(bill):
+    """Bills of the same tenancy that start after `bill`, oldest first."""
+    return Billing.objects.filter(
+        offline_tenant_id=bill.offline_tenant_id,
+        online_tenant_id=bill.online_tenant_id,
+        start_date__gt=bill.start_date,
+    ).order_by('start_date', 'id')
+
+
+def recompute_following(bill, chunk_size=100):
+    """
+    Carry `bill`'s closing meter reading and remaining due into the bills after it.
+
+    Later bills are streamed from one ordered query and written back with a
+    single bulk_update. The walk stops at the first bill whose carried-in
+    values are already correct, since everything after it is unaffected.
+    Returns the number of bills updated.
+    """
+    prev_meter = bill.current_meter_reading or 0
+    prev_due = bill.remaining_due_amount or 0
+    now = timezone.now()
+    changed = []
+
+    for b in later_bills(bill).iterator(chunk_size=chunk_size):
+        meter_ok = b.current_meter_reading is not None and b.current_meter_reading >= prev_meter
+        if b.previous_meter_reading == prev_meter and b.previous_due_amount == prev_due and meter_ok:
+            break
+
+        b.previous_meter_reading = prev_meter
+        if not meter_ok:
+            b.current_meter_reading = prev_meter  # avoid negative consumption
+        b.previous_due_amount = prev_due
+        b.recalculate()
+        b.updated_at = now
+        changed.append(b)
+
+        prev_meter = b.current_meter_reading
+        prev_due = b.remaining_due_amount
+
+    if changed:
+        with transaction.atomic():
+            Billing.objects.bulk_update(changed, LEDGER_FIELDS, batch_size=chunk_size)
+            # bulk_update skips Billing.save, so refresh the snapshot here
+            TenancyBalance.refresh_for(bill.offline_tenant_id, bill.online_tenant_id)
+    return len(changed)
+
+
+# ------------------ Balance snapshots ------------------
+BALANCE_FIELDS = ['latest_bill_id', 'current_due', 'last_meter_reading', 'last_period_end']
+
+
+def upsert_balances(balances, batch_size=1000):
+    """Insert-or-update TenancyBalance rows, one ON CONFLICT statement per tenant type."""
+    offline = [b for b in balances if b.offline_tenant_id]
+    online = [b for b in balances if b.online_tenant_id]
+    for rows, unique_field in ((offline, 'offline_tenant'), (online, 'online_tenant')):
+        if rows:
+            TenancyBalance.objects.bulk_create(
+                rows, batch_size=batch_size, update_conflicts=True,
+                unique_fields=[unique_field], update_fields=BALANCE_FIELDS + ['updated_at'],
+            )
+
+
+def expected_balances(bills=None):
+    """{(offline_tenant_id, online_tenant_id): TenancyBalance} built from the latest bill of every tenancy in `bills`."""
+    bills = Billing.objects.all() if bills is None else bills
+    latest = bills.annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('offline_tenant_id'), F('online_tenant_id')],
+            order_by=[F('end_date').desc(), F('id').desc()],
+        )
+    ).filter(row_number=1).only(
+        'id', 'offline_tenant_id', 'online_tenant_id', 'remaining_due_amount',
+        'current_meter_reading', 'end_date',
+    )
+    return {
+        (bill.offline_tenant_id, bill.online_tenant_id): TenancyBalance(
+            offline_tenant_id=bill.offline_tenant_id,
+            online_tenant_id=bill.online_tenant_id,
+            **TenancyBalance.values_from_bill(bill),
+        )
+        for bill in latest
+    }
+
+
+def refresh_balances(offline_ids=(), online_ids=(), chunk_size=500):
+    """Re-read the latest bill of the given tenancies into their snapshots, chunk by chunk."""
+    offline_ids, online_ids = list(offline_ids), list(online_ids)
+    for ids, field in ((offline_ids, 'offline_tenant_id'), (online_ids, 'online_tenant_id')):
+        for i in range(0, len(ids), chunk_size):
+            bills = Billing.objects.filter(**{f'{field}__in': ids[i:i + chunk_size]})
+            upsert_balances(list(expected_balances(bills).values()), batch_size=chunk_size)
+
+
+def rebuild_balances(verify_only=False):
+    """
+    Compare every snapshot with the bills and, unless verify_only, fix the drift.
+
+    Returns (mismatched, missing, stale) counts as found before fixing.
+    """
+    expected = expected_balances()
+    actual = {
+        (row['offline_tenant_id'], row['online_tenant_id']): row
+        for row in TenancyBalance.objects.values('id', 'offline_tenant_id', 'online_tenant_id', *BALANCE_FIELDS)
+    }
+
+    missing = [key for key in expected if key not in actual]
+    mismatched = [
+        key for key in expected
+        if key in actual and any(actual[key][f] != getattr(expected[key], f) for f in BALANCE_FIELDS)
+    ]
+    stale = [row['id'] for key, row in actual.items() if key not in expected]
+
+    if not verify_only:
+        with transaction.atomic():
+            TenancyBalance.objects.filter(id__in=stale).delete()
+            upsert_balances([expected[key] for key in missing + mismatched])
+
+    return len(mismatched), len(missing), len(stale)
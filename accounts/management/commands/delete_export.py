@@ -1,30 +1,71 @@
-from django.core.management.base import BaseCommand
-from accounts.models import Billing, OfflineTenants, LinkTenantLandlord
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from accounts.ledger import rebuild_balances
+from accounts.models import Billing, DeletedRecord
+
+
+def bills_beyond_latest(keep):
+    """Ids of every bill older than the `keep` newest of its tenancy, in one windowed query."""
+    ranked = Billing.objects.annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('offline_tenant_id'), F('online_tenant_id')],
+            order_by=[F('created_at').desc(), F('id').desc()],
+        )
+    )
+    return list(ranked.filter(row_number__gt=keep).values_list('id', flat=True))
+
+
+def delete_bills(ids):
+    """
+    Delete bills by id with one raw DELETE, skipping Django's cascade collector.
+
+    Nothing cascades from Billing (TenancyBalance.latest_bill has no DB
+    constraint and is rebuilt after pruning); the tombstones post_delete
+    would have written are created in bulk instead.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {Billing._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+            ids,
+        )
+    DeletedRecord.objects.bulk_create(
+        [DeletedRecord(model_name=Billing._meta.model_name, object_id=bill_id) for bill_id in ids]
+    )
+
 
 class Command(BaseCommand):
     help = "Delete old bills on mobile, keep only latest bill per tenant"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, default=1, help="Latest bills to keep per tenant")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Bills deleted per statement")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        keep = options["keep"]
+        chunk_size = options["chunk_size"]
+        if keep < 1:
+            raise CommandError("--keep must be at least 1")
+
+        ids = bills_beyond_latest(keep)
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {len(ids)} old bills, keeping {keep} per tenant.")
+            return
+
         total_deleted = 0
+        with transaction.atomic():
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                delete_bills(chunk)
+                total_deleted += len(chunk)
+                self.stdout.write(f"Deleted {total_deleted}/{len(ids)} bills")
 
-        # Offline tenants
-        for tenant in OfflineTenants.objects.all():
-            bills = Billing.objects.filter(offline_tenant=tenant).order_by('-created_at')
-            if bills.count() > 1:
-                latest_bill = bills.first()
-                bills_to_delete = bills.exclude(id=latest_bill.id)
-                deleted_count, _ = bills_to_delete.delete()
-                total_deleted += deleted_count
-
-        # Online tenants
-        for link in LinkTenantLandlord.objects.all():
-            bills = Billing.objects.filter(online_tenant=link).order_by('-created_at')
-            if bills.count() > 1:
-                latest_bill = bills.first()
-                bills_to_delete = bills.exclude(id=latest_bill.id)
-                deleted_count, _ = bills_to_delete.delete()
-                total_deleted += deleted_count
+            # Pruning keeps the newest by created_at; re-point snapshots at surviving bills
+            rebuild_balances()
 
         self.stdout.write(self.style.SUCCESS(
-            f"Deleted {total_deleted} old bills. Each tenant now has only 1 latest bill."
+            f"Deleted {total_deleted} old bills. Each tenant now has only {keep} latest bill(s)."
         ))
@@ -1,89 +1,218 @@
-import os
+import gzip
 import json
-from django.core.management.base import BaseCommand
-from accounts.models import CustomUser, OfflineTenants, LinkTenantLandlord, Billing
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from accounts.models import (
+    CustomUser, OfflineTenants, LinkTenantLandlord, Billing, LinkRequest, ChatMessage, DeletedRecord,
+)
 
-class Command(BaseCommand):
-    help = "Export mobile data: landlords, tenants (offline/online), links, and bills"
-
-    def handle(self, *args, **kwargs):
-        data = {
-            "landlords": [],
-            "online_tenants": [],
-            "offline_tenants": [],
-            "links": [],
-            "bills": []
+
+# ---------------- Sections ----------------
+# Each section yields plain dicts straight from values(), so rows are never
+# turned into model instances and no relation is loaded lazily. `since`
+# limits a section to rows changed at or after that time (delta mode).
+
+def changed(qs, since, field='updated_at'):
+    return qs.filter(**{f'{field}__gte': since}) if since else qs
+
+
+def landlords(chunk_size, since=None):
+    rows = CustomUser.objects.filter(role='landlord').values(
+        'id', 'username', 'email', phone=F('phone_number')
+    ).order_by('id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def online_tenants(chunk_size, since=None):
+    rows = changed(LinkTenantLandlord.objects, since).values(
+        'tenant_id', 'tenant__username', 'tenant__phone_number', 'landlord_id'
+    ).order_by('id')
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield {
+            "id": row['tenant_id'],
+            "username": row['tenant__username'],
+            "phone": row['tenant__phone_number'],
+            "linked_landlord_id": row['landlord_id'],
+        }
+
+
+def offline_tenants(chunk_size, since=None):
+    rows = changed(OfflineTenants.objects, since).values(
+        'id', 'name', 'landlord_id', phone=F('phone_number')
+    ).order_by('id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def links(chunk_size, since=None):
+    rows = changed(LinkTenantLandlord.objects, since).values(
+        'id', 'tenant_id', 'landlord_id', 'property_name', 'rent', 'due_amount', 'meter_rate',
+        'starting_meter_reading', 'start_date', 'end_date',
+    ).order_by('id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def bills(chunk_size, since=None):
+    rows = changed(Billing.objects, since).values(
+        'id', 'offline_tenant_id', 'rent', 'amount_paid', 'start_date', 'end_date',
+        'current_meter_reading', 'previous_meter_reading', 'meter_rate',
+        'misc_charge', 'misc_note', 'status',
+        online_user_id=F('online_tenant__tenant_id'),
+        previous_due=F('previous_due_amount'),
+    ).order_by('id')
+    for row in rows.iterator(chunk_size=chunk_size):
+        offline_id = row.pop('offline_tenant_id')
+        online_id = row.pop('online_user_id')
+        yield {
+            "tenant_type": "offline" if offline_id else "online",
+            "tenant_id": offline_id or online_id,
+            **row,
         }
 
-        # ---------------- Landlords ----------------
-        landlords = CustomUser.objects.filter(role='landlord')
-        for l in landlords:
-            data['landlords'].append({
-                "id": l.id,
-                "username": l.username,
-                "phone": l.phone_number,
-                "email": l.email
-            })
-
-        # ---------------- Online Tenants ----------------
-        online_links = LinkTenantLandlord.objects.all()
-        for link in online_links:
-            tenant = link.tenant
-            data['online_tenants'].append({
-                "id": tenant.id,
-                "username": tenant.username,
-                "phone": tenant.phone_number,
-                "linked_landlord_id": link.landlord.id
-            })
-
-        # ---------------- Offline Tenants ----------------
-        offline_tenants = OfflineTenants.objects.all()
-        for t in offline_tenants:
-            data['offline_tenants'].append({
-                "id": t.id,
-                "name": t.name,
-                "landlord_id": t.landlord.id,
-                "phone": t.phone_number
-            })
-
-        # ---------------- Links ----------------
-        for link in online_links:
-            data['links'].append({
-                "tenant_id": link.tenant.id,
-                "landlord_id": link.landlord.id,
-                "property_name": link.property_name,
-                "rent": link.rent,
-                "due_amount": link.due_amount,
-                "meter_rate": link.meter_rate,
-                "starting_meter_reading": link.starting_meter_reading,
-                "start_date": str(link.start_date) if link.start_date else None,
-                "end_date": str(link.end_date) if link.end_date else None,
-            })
-
-        # ---------------- Bills ----------------
-        bills = Billing.objects.all()
-        for b in bills:
-            tenant_type = "offline" if b.offline_tenant else "online"
-            tenant_id = b.offline_tenant.id if b.offline_tenant else b.online_tenant.tenant.id
-            data['bills'].append({
-                "tenant_type": tenant_type,
-                "tenant_id": tenant_id,
-                "rent": b.rent,
-                "amount_paid": b.amount_paid,
-                "previous_due": b.previous_due_amount,
-                "start_date": str(b.start_date),
-                "end_date": str(b.end_date),
-                "current_meter_reading": b.current_meter_reading,
-                "previous_meter_reading": b.previous_meter_reading,
-                "meter_rate": b.meter_rate,
-                "misc_charge": b.misc_charge,
-                "misc_note": b.misc_note,
-                "status": b.status,
-            })
-
-        # ---------------- Save JSON ----------------
-        output_file = os.path.join(os.getcwd(), "mobile_export.json")
-        with open(output_file, "w") as f:
-            json.dump(data, f, indent=2)
-
-        self.stdout.write(self.style.SUCCESS(f"Exported data to {output_file}"))
+
+def link_requests(chunk_size, since=None):
+    rows = changed(LinkRequest.objects, since).values(
+        'id', 'sender_id', 'receiver_id', 'status', 'property_name', 'rent', 'due_amount',
+        'meter_rate', 'starting_meter_reading', 'start_date', 'end_date', 'note',
+    ).order_by('id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def chat_messages(chunk_size, since=None):
+    rows = changed(ChatMessage.objects, since).values(
+        'id', 'sender_id', 'receiver_id', 'message', 'timestamp', 'read',
+    ).order_by('id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def deleted(chunk_size, since=None):
+    rows = changed(DeletedRecord.objects, since, field='deleted_at').values(
+        'object_id', 'deleted_at', model=F('model_name'),
+    ).order_by('id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+SECTIONS = [
+    ("landlords", landlords),
+    ("online_tenants", online_tenants),
+    ("offline_tenants", offline_tenants),
+    ("links", links),
+    ("bills", bills),
+    ("link_requests", link_requests),
+    ("chat_messages", chat_messages),
+]
+
+# Sections of an incremental export; users carry no change tracking and are left out
+DELTA_SECTIONS = [
+    ("online_tenants", online_tenants),
+    ("offline_tenants", offline_tenants),
+    ("links", links),
+    ("bills", bills),
+    ("link_requests", link_requests),
+    ("chat_messages", chat_messages),
+    ("deleted", deleted),
+]
+
+
+# updated_at is stamped when a row is saved, not when it commits, so a row
+# saved just before an export started can commit after it. The stored
+# checkpoint is moved back by this much; clients upsert by id, so rows seen
+# twice are harmless.
+CHECKPOINT_OVERLAP = timedelta(seconds=getattr(settings, "EXPORT_CHECKPOINT_OVERLAP_SECONDS", 300))
+
+
+def encode(record):
+    # default=str renders dates as YYYY-MM-DD
+    return json.dumps(record, default=str, separators=(",", ":"))
+
+
+class Command(BaseCommand):
+    help = "Export mobile data: landlords, tenants (offline/online), links, bills, invites and chat"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="Output file (default: mobile_export.json[l][.gz] in the cwd)")
+        parser.add_argument(
+            "--format", choices=["json", "ndjson"], default="json",
+            help="json: one object with a list per section; ndjson: one record per line with a 'type' key"
+        )
+        parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per database round trip")
+        parser.add_argument(
+            "--since", help="Delta mode: only rows changed at or after this ISO datetime, plus deletions"
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Delta mode with a checkpoint file: export changes since the time stored in it, "
+                 "then store this export's start time less an overlap window (a missing file means a full delta)"
+        )
+
+    def read_checkpoint(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)["since"]
+
+    def parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            raise CommandError(f"Invalid --since datetime: {value}")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def handle(self, *args, **options):
+        fmt = options["format"]
+        checkpoint = options["checkpoint"]
+        delta = bool(options["since"] or checkpoint)
+        since_value = options["since"] or (self.read_checkpoint(checkpoint) if checkpoint else None)
+        since = self.parse_since(since_value) if since_value else None
+        sections = DELTA_SECTIONS if delta else SECTIONS
+        # Rows changed while the export runs are picked up again next time
+        export_started_at = timezone.now()
+        output_file = options["output"] or os.path.join(
+            os.getcwd(), "mobile_export.json" + ("l" if fmt == "ndjson" else "") + (".gz" if options["gzip"] else "")
+        )
+        opener = gzip.open if options["gzip"] else open
+
+        started = time.monotonic()
+        total_rows = 0
+        with opener(output_file, "wt", encoding="utf-8") as f:
+            if fmt == "json":
+                f.write("{")
+            if fmt == "json" and delta:
+                f.write(f'\n"since":{encode(since)},"until":{encode(export_started_at)},')
+            for index, (name, section) in enumerate(sections):
+                section_started = time.monotonic()
+                count = 0
+
+                if fmt == "json":
+                    f.write(f'{"," if index else ""}\n"{name}":[')
+                for record in section(options["chunk_size"], since):
+                    if fmt == "json":
+                        f.write(("," if count else "") + "\n" + encode(record))
+                    else:
+                        f.write(encode({"type": name, **record}) + "\n")
+                    count += 1
+                if fmt == "json":
+                    f.write("]")
+
+                elapsed = time.monotonic() - section_started
+                total_rows += count
+                self.stdout.write(f"{name}: {count} rows ({count / elapsed if elapsed else count:.0f} rows/s)")
+            if fmt == "json":
+                f.write("\n}\n")
+
+        if checkpoint:
+            with open(checkpoint, "w") as f:
+                json.dump({"since": (export_started_at - CHECKPOINT_OVERLAP).isoformat()}, f)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {total_rows} rows to {output_file} in {elapsed:.2f}s "
+            f"({total_rows / elapsed if elapsed else total_rows:.0f} rows/s)"
+        ))
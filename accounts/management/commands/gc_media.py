@@ -0,0 +1,119 @@
+import os
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.models import Billing, MediaBlob, TenantDocument
+from accounts.storage import BLOB_DIR, content_storage
+
+# Every file column that points into media storage
+FILE_COLUMNS = (
+    (Billing, 'meter_photo'),
+    (Billing, 'meter_photo_thumbnail'),
+    (TenantDocument, 'file'),
+)
+# Where uploads were written before content-addressed storage
+LEGACY_DIRS = ('meter_photos', 'tenant_documents')
+
+
+def referenced_names(chunk_size=2000):
+    """How many rows point at each stored file name, read column by column."""
+    counts = Counter()
+    for model, field in FILE_COLUMNS:
+        names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        counts.update(names.values_list(field, flat=True).iterator(chunk_size=chunk_size))
+    return counts
+
+
+def is_referenced(name):
+    """Whether any row points at `name` right now."""
+    return any(model.objects.filter(**{field: name}).exists() for model, field in FILE_COLUMNS)
+
+
+def remove_if_unused(name, path, cutoff):
+    """
+    Delete one file the scan found unreferenced, re-checking first: an upload
+    may have reused the blob, or a row may have started pointing at it, since.
+
+    Deleting the blob row takes the database write lock, so no upload can
+    add a reference and no row can be committed until this file is decided.
+    The file is then moved aside before its mtime is read again: an upload
+    that touched it just before the move shows up there, and one arriving
+    after finds no file and writes a fresh copy. Returns the bytes freed,
+    or None if the file was kept.
+    """
+    with transaction.atomic():
+        MediaBlob.objects.filter(name=name).delete()
+        if is_referenced(name):
+            transaction.set_rollback(True)
+            return None
+        doomed = f"{path}.gc"
+        try:
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            return 0
+        stat = os.stat(doomed)
+        if stat.st_mtime > cutoff:
+            os.replace(doomed, path)
+            transaction.set_rollback(True)
+            return None
+        os.remove(doomed)
+    return stat.st_size
+
+
+def stored_files(root, directories):
+    """(name, full path) of every file under the given media directories."""
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(os.path.join(root, directory)):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, root).replace(os.sep, '/'), path
+
+
+class Command(BaseCommand):
+    help = "Delete media files no row refers to and correct blob reference counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-minutes", type=int, default=60,
+            help="Leave files younger than this alone (their rows may not be committed yet)",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        storage = content_storage()
+        cutoff = time.time() - options["grace_minutes"] * 60
+        dry_run = options["dry_run"]
+
+        # The rows are the source of truth; reference counts drift through raw deletes
+        references = referenced_names()
+        blobs = {blob.name: blob for blob in MediaBlob.objects.all()}
+
+        doomed, freed = [], 0
+        for name, path in stored_files(storage.location, (BLOB_DIR, *LEGACY_DIRS)):
+            if not references.get(name) and os.path.getmtime(path) <= cutoff:
+                doomed.append((name, path))
+                freed += os.path.getsize(path)
+
+        doomed_names = {name for name, _ in doomed}
+        drifted = [
+            blob for name, blob in blobs.items()
+            if name not in doomed_names and blob.refs != references.get(name, 0)
+        ]
+
+        if not dry_run:
+            # The scan is only a shortlist: each file is checked again as it is removed
+            removed = [remove_if_unused(name, path, cutoff) for name, path in doomed]
+            removed = [size for size in removed if size is not None]
+            doomed, freed = removed, sum(removed)
+            # Counts an upload or delete changed since the scan are left to the next run
+            drifted = [
+                blob for blob in drifted
+                if MediaBlob.objects.filter(id=blob.id, refs=blob.refs).update(refs=references.get(blob.name, 0))
+            ]
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(doomed)} unreferenced files ({freed / (1024 * 1024):.1f} MB); "
+            f"{len(drifted)} reference counts {'to correct' if dry_run else 'corrected'}."
+        ))
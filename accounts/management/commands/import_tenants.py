@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import CustomUser
+from accounts.tenant_import import ImportFileError, import_tenants, read_csv
+
+
+class Command(BaseCommand):
+    help = "Bulk-add offline tenants and invites for a landlord from a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("landlord", help="Username of the landlord the tenants belong to")
+        parser.add_argument("csv_file", help="CSV with a header row; rows with username_or_phone become invites")
+        parser.add_argument("--dry-run", action="store_true", help="Validate every row without writing")
+
+    def handle(self, *args, **options):
+        try:
+            landlord = CustomUser.objects.get(username=options["landlord"], role="landlord")
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No landlord named {options['landlord']}")
+
+        try:
+            with open(options["csv_file"], "rb") as f:
+                rows = read_csv(f.read())
+        except (OSError, ImportFileError) as exc:
+            raise CommandError(str(exc))
+
+        result = import_tenants(landlord, rows, dry_run=options["dry_run"])
+
+        failed = [entry for entry in result["rows"] if entry["errors"]]
+        for entry in failed:
+            problems = "; ".join(f"{field}: {' '.join(msgs)}" for field, msgs in entry["errors"].items())
+            self.stderr.write(f"Row {entry['row']} ({entry['kind']}): {problems}")
+        if failed:
+            raise CommandError(f"{len(failed)} of {len(rows)} rows are invalid; nothing was imported.")
+
+        verb = "Would import" if options["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result['offline']} offline tenants and {result['invites']} invites."
+        ))
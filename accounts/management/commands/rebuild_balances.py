@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.ledger import rebuild_balances
+
+class Command(BaseCommand):
+    help = "Rebuild the TenancyBalance snapshot table from bills (or only verify it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Report drift without fixing it")
+
+    def handle(self, *args, **options):
+        mismatched, missing, stale = rebuild_balances(verify_only=options["verify"])
+        summary = f"{mismatched} out of date, {missing} missing, {stale} without bills"
+
+        if options["verify"]:
+            if mismatched or missing or stale:
+                raise CommandError(f"Balance snapshots drifted: {summary}")
+            self.stdout.write(self.style.SUCCESS("Balance snapshots match the bills."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Balance snapshots rebuilt: {summary}"))
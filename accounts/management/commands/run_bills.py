@@ -1,9 +1,21 @@
-from django.core.management.base import BaseCommand
-from accounts.scheduler import generate_bills
+from django.core.management.base import BaseCommand, CommandError
+from accounts.scheduler import run_billing_job, DEFAULT_CHUNK_SIZE
 
 class Command(BaseCommand):
-    help = "Generate bills manually"
+    help = "Generate bills manually (under the same lease and run history as the scheduler)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+            help="Number of bills written per bulk INSERT"
+        )
 
     def handle(self, *args, **options):
-        generate_bills()
-        self.stdout.write(self.style.SUCCESS("Bills generated successfully"))
+        result = run_billing_job(chunk_size=options["chunk_size"])
+        if result is None:
+            raise CommandError("Another billing run holds the lease; try again once it finishes.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Bills generated successfully: {result['bills_created']} bills for "
+            f"{result['tenants_billed']} of {result['tenants_scanned']} tenants "
+            f"in {result['elapsed_seconds']:.2f}s"
+        ))
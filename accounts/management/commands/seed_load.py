@@ -0,0 +1,204 @@
+import random
+import time
+from datetime import date, timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts.ledger import refresh_balances
+from accounts.models import (
+    Billing, ChatMessage, CustomUser, LinkRequest, LinkTenantLandlord, OfflineTenants,
+)
+from accounts.scheduler import add_one_month
+
+
+def monthly_periods(start, months):
+    """(start_date, end_date) of `months` consecutive billing periods from `start`."""
+    periods = []
+    for _ in range(months):
+        end = add_one_month(start) - timedelta(days=1)
+        periods.append((start, end))
+        start = end + timedelta(days=1)
+    return periods
+
+
+BILL_COLUMNS = (
+    'offline_tenant_id', 'online_tenant_id', 'start_date', 'end_date', 'rent', 'meter_rate',
+    'previous_meter_reading', 'current_meter_reading', 'previous_due_amount', 'misc_charge',
+    'total_amount', 'amount_paid', 'remaining_due_amount', 'status', 'created_at', 'updated_at',
+)
+MESSAGE_COLUMNS = ('sender_id', 'receiver_id', 'message', 'read', 'timestamp', 'updated_at')
+
+
+def bill_rows(rng, periods, now, offline_tenant_id, online_tenant_id, rent, meter_rate, meter, due):
+    """
+    Row tuples (in BILL_COLUMNS order) for consecutive periods of one tenancy.
+    Each bill carries the previous bill's meter reading and remaining due, as
+    the scheduler and the ledger chain them; totals and status follow
+    Billing.recalculate. Payments are full, partial or missing.
+    """
+    rows = []
+    for start_date, end_date in periods:
+        reading = meter + rng.randint(40, 300)
+        misc_charge = rng.choice((0, 0, 0, 250, 500))
+        total = rent + due + (reading - meter) * meter_rate + misc_charge
+
+        outcome = rng.random()
+        paid = total if outcome < 0.7 else rng.randint(1, total) if outcome < 0.9 else 0
+        remaining = total - paid
+        status = 'paid' if remaining <= 0 else 'partial' if paid else 'unpaid'
+
+        rows.append((
+            offline_tenant_id, online_tenant_id, start_date, end_date, rent, meter_rate,
+            meter, reading, due, misc_charge, total, paid, remaining, status, now, now,
+        ))
+        meter, due = reading, remaining
+    return rows
+
+
+def insert_rows(model, columns, rows):
+    """
+    One executemany INSERT of plain tuples, skipping model instances and
+    per-field value preparation, which dominate bulk_create at millions of
+    rows. Dates and datetimes must already be in database form.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ", ".join(connection.ops.quote_name(model._meta.get_field(c).column) for c in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {table} ({names}) VALUES ({placeholders})", rows)
+    return len(rows)
+
+
+class Command(BaseCommand):
+    help = "Bulk-create synthetic landlords, tenants, bills, invites and chat for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--landlords", type=int, default=20, help="Landlord accounts to create")
+        parser.add_argument("--offline", type=int, default=50, help="Offline tenants per landlord")
+        parser.add_argument("--online", type=int, default=50, help="Linked online tenants per landlord")
+        parser.add_argument("--invites", type=int, default=5, help="Pending invites sent per landlord")
+        parser.add_argument("--months", type=int, default=36, help="Months of bill history per tenancy")
+        parser.add_argument("--messages", type=int, default=20, help="Chat messages per online link")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, for repeatable datasets")
+        parser.add_argument("--prefix", default="load", help="Username prefix of the created accounts")
+        parser.add_argument("--password", default="loadtest", help="Password of the created accounts")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk INSERT")
+
+    def handle(self, *args, **options):
+        if options["months"] < 1:
+            raise CommandError("--months must be at least 1")
+        if len(options["prefix"]) > 8:
+            raise CommandError("--prefix must be at most 8 characters (usernames are limited to 20)")
+
+        started = time.monotonic()
+        rng = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+        prefix = options["prefix"]
+        password = make_password(options["password"])  # hashed once, shared by every account
+
+        # History ends with the last full month so the scheduler picks up from there
+        first_of_month = date.today().replace(day=1)
+        history_start = first_of_month
+        for _ in range(options["months"]):
+            history_start = (history_start - timedelta(days=1)).replace(day=1)
+        periods = monthly_periods(history_start, options["months"])
+
+        # Keep usernames unique across repeated runs with the same prefix
+        offset = CustomUser.objects.filter(username__startswith=prefix).count()
+
+        def users(role, count):
+            nonlocal offset
+            created = CustomUser.objects.bulk_create([
+                CustomUser(username=f"{prefix}{offset + i}", role=role, password=password,
+                           first_name=role.title(), last_name=str(offset + i))
+                for i in range(count)
+            ], batch_size=batch_size)
+            offset += count
+            return created
+
+        counts = dict.fromkeys(
+            ("landlords", "offline tenants", "online tenants", "invites", "bills", "messages"), 0
+        )
+        with transaction.atomic():
+            landlords = users("landlord", options["landlords"])
+            counts["landlords"] = len(landlords)
+
+            offline = OfflineTenants.objects.bulk_create([
+                OfflineTenants(
+                    landlord=landlord, name=f"Tenant {landlord.id}-{i}",
+                    phone_number=f"{rng.randint(6_000_000_000, 9_999_999_999)}",
+                    property_name=f"Room {i + 1}", rent=rng.randrange(3000, 15001, 500),
+                    meter_rate=rng.choice((8, 10, 12)), starting_meter_reading=rng.randint(0, 5000),
+                    start_date=history_start,
+                )
+                for landlord in landlords for i in range(options["offline"])
+            ], batch_size=batch_size)
+            counts["offline tenants"] = len(offline)
+
+            tenants = users("tenant", options["landlords"] * options["online"])
+            links = LinkTenantLandlord.objects.bulk_create([
+                LinkTenantLandlord(
+                    landlord=landlords[i // options["online"]], tenant=tenant,
+                    property_name=f"Flat {i % options['online'] + 1}", rent=rng.randrange(5000, 25001, 500),
+                    meter_rate=rng.choice((8, 10, 12)), starting_meter_reading=rng.randint(0, 5000),
+                    start_date=history_start,
+                )
+                for i, tenant in enumerate(tenants)
+            ], batch_size=batch_size)
+            counts["online tenants"] = len(links)
+
+            invitees = users("tenant", options["landlords"] * options["invites"])
+            counts["invites"] = len(LinkRequest.objects.bulk_create([
+                LinkRequest(
+                    sender=landlords[i // options["invites"]], receiver=invitee, status="pending",
+                    property_name=f"Flat {i + 1}", rent=rng.randrange(5000, 25001, 500), meter_rate=10,
+                    start_date=first_of_month,
+                )
+                for i, invitee in enumerate(invitees)
+            ], batch_size=batch_size))
+
+            # Bills and messages are streamed to the database so memory stays flat at any size
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            periods = [
+                (connection.ops.adapt_datefield_value(start), connection.ops.adapt_datefield_value(end))
+                for start, end in periods
+            ]
+            tenancies = [
+                (t.id, None, t.rent, t.meter_rate, t.starting_meter_reading, t.due_amount) for t in offline
+            ] + [
+                (None, link.id, link.rent, link.meter_rate, link.starting_meter_reading, link.due_amount)
+                for link in links
+            ]
+            pending = []
+            for tenancy in tenancies:
+                pending.extend(bill_rows(rng, periods, now, *tenancy))
+                if len(pending) >= batch_size:
+                    counts["bills"] += insert_rows(Billing, BILL_COLUMNS, pending)
+                    pending = []
+            counts["bills"] += insert_rows(Billing, BILL_COLUMNS, pending)
+
+            refresh_balances(
+                offline_ids=[t.id for t in offline], online_ids=[link.id for link in links],
+                chunk_size=500,
+            )
+
+            pending = []
+            for link in links:
+                pending.extend(
+                    (link.landlord_id, link.tenant_id, f"Message {n + 1}", True, now, now) if n % 2 == 0
+                    else (link.tenant_id, link.landlord_id, f"Message {n + 1}", True, now, now)
+                    for n in range(options["messages"])
+                )
+                if len(pending) >= batch_size:
+                    counts["messages"] += insert_rows(ChatMessage, MESSAGE_COLUMNS, pending)
+                    pending = []
+            counts["messages"] += insert_rows(ChatMessage, MESSAGE_COLUMNS, pending)
+
+        summary = ", ".join(f"{count} {label}" for label, count in counts.items())
+        self.stdout.write(
+            f"Seed {options['seed']}, prefix '{prefix}', {options['months']} months from {history_start}"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary} in {time.monotonic() - started:.1f}s"
+        ))
@@ -1,11 +1,151 @@
-from .scheduler import generate_bills
+import logging
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+from .profiling import QueryProfile
+from .scheduler import trigger_billing_if_due
+
+slow_log = logging.getLogger("accounts.slow_requests")
+
+
+class BillingWatermarkMiddleware:
+    """
+    Kick off bill generation at most once per calendar day.
+
+    The check is a cached watermark lookup; the run itself happens on a
+    background thread so the request never waits for it.
+    """
+    sync_capable = True
+    async_capable = True
 
-class RunBillsOnEveryVisitMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Run generate_bills() on every request
-        generate_bills()
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger_billing_if_due()
         response = self.get_response(request)
         return response
+
+    async def __acall__(self, request):
+        # The watermark lookup may hit the DB; the rest of the chain stays async
+        await sync_to_async(trigger_billing_if_due)()
+        return await self.get_response(request)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, made async-capable.
+
+    WhiteNoiseMiddleware is sync-only, and a single sync-only middleware
+    makes Django run the whole ASGI chain in a worker thread, so even the
+    async chat long-poll would hold one for its full wait. Here only
+    requests for static files go through a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class QueryProfilingMiddleware:
+    """
+    Opt-in (SQL_PROFILING) per-request SQL profile.
+
+    Every database connection is wrapped for the duration of the request to
+    count statements, time them and group them by fingerprint. The totals go
+    out as a Server-Timing header; requests over SQL_PROFILING_SLOW_MS or
+    SQL_PROFILING_MAX_QUERIES are written to the accounts.slow_requests log
+    with their most expensive and most repeated query templates.
+
+    Async-capable, so once the whole chain runs async under ASGI the
+    queries of async views (wait_for_messages) are still counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "SQL_PROFILING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, "SQL_PROFILING_SLOW_MS", 500)
+        self.max_queries = getattr(settings, "SQL_PROFILING_MAX_QUERIES", 50)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, started = QueryProfile(), time.perf_counter()
+        with self.wrap_connections(profile):
+            response = self.get_response(request)
+        return self.finish(request, response, profile, started)
+
+    async def __acall__(self, request):
+        profile, started = QueryProfile(), time.perf_counter()
+        # Connections are per thread: wrap them in the thread that the request's
+        # thread-sensitive sync_to_async calls (every async ORM query) run in
+        stack = await sync_to_async(self.wrap_connections)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, profile, started)
+
+    def wrap_connections(self, profile):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        return stack
+
+    def finish(self, request, response, profile, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = profile.duration * 1000
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={db_ms:.1f};desc="{profile.count} queries"',
+            f'dup;desc="{profile.exact_duplicates} repeated"',
+            f"app;dur={total_ms - db_ms:.1f}",
+            f"total;dur={total_ms:.1f}",
+        ])
+
+        if total_ms >= self.slow_ms or profile.count >= self.max_queries:
+            self.log_slow(request, response, profile, total_ms, db_ms)
+        return response
+
+    def log_slow(self, request, response, profile, total_ms, db_ms):
+        lines = [
+            f"{request.method} {request.get_full_path()} -> {response.status_code}: "
+            f"{total_ms:.0f}ms total, {db_ms:.0f}ms in {profile.count} queries "
+            f"({profile.exact_duplicates} exact repeats)"
+        ]
+        lines += [
+            f"  {seconds * 1000:8.1f}ms x{count:<4} {template}"
+            for template, count, seconds in profile.top_templates()
+        ]
+        lines += [f"  repeated x{count:<4} {template}" for template, count in profile.duplicates[:5]]
+        slow_log.warning("\n".join(lines))
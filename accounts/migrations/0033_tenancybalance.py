@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def build_balances(apps, schema_editor):
+    Billing = apps.get_model('accounts', 'Billing')
+    TenancyBalance = apps.get_model('accounts', 'TenancyBalance')
+
+    latest = Billing.objects.annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('offline_tenant_id'), F('online_tenant_id')],
+            order_by=[F('end_date').desc(), F('id').desc()],
+        )
+    ).filter(row_number=1)
+
+    TenancyBalance.objects.bulk_create([
+        TenancyBalance(
+            offline_tenant_id=bill.offline_tenant_id,
+            online_tenant_id=bill.online_tenant_id,
+            latest_bill_id=bill.id,
+            current_due=bill.remaining_due_amount or 0,
+            last_meter_reading=bill.current_meter_reading or 0,
+            last_period_end=bill.end_date,
+        )
+        for bill in latest
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0032_change_tracking_and_tombstones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenancyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_due', models.IntegerField(default=0)),
+                ('last_meter_reading', models.IntegerField(default=0)),
+                ('last_period_end', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('latest_bill', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='accounts.billing')),
+                ('offline_tenant', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='accounts.offlinetenants')),
+                ('online_tenant', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='accounts.linktenantlandlord')),
+            ],
+        ),
+        migrations.RunPython(build_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,161 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:53
+
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+# Inputs of a bill; duplicate periods are only merged when these all agree
+AMOUNT_FIELDS = [
+    'rent', 'previous_due_amount', 'previous_meter_reading', 'current_meter_reading',
+    'meter_rate', 'misc_charge', 'amount_paid',
+]
+
+
+def clean_bills(apps, schema_editor):
+    """
+    Make existing rows satisfy the new constraints before adding them.
+
+    Nothing that holds money is dropped silently: the migration stops and
+    lists unassigned bills with a payment recorded, and duplicate periods
+    whose amounts differ, for someone to resolve by hand. Rows it does
+    delete get tombstones for delta exports, and the balances of every
+    tenancy touched are rebuilt (0033 built them from the uncleaned rows).
+    """
+    Billing = apps.get_model('accounts', 'Billing')
+    DeletedRecord = apps.get_model('accounts', 'DeletedRecord')
+
+    # Bills pointing at both kinds of tenant keep the offline one, as __str__ and the views do.
+    # Done first, as it can create duplicates; raising below rolls it back with the rest.
+    both = Billing.objects.filter(offline_tenant__isnull=False, online_tenant__isnull=False)
+    moved = list(both.values_list('offline_tenant_id', 'online_tenant_id'))
+    both.update(online_tenant=None)
+
+    unassigned = Billing.objects.filter(offline_tenant__isnull=True, online_tenant__isnull=True)
+    duplicates = Billing.objects.exclude(offline_tenant__isnull=True, online_tenant__isnull=True).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('offline_tenant_id'), F('online_tenant_id'), F('start_date'), F('end_date')],
+            order_by=[F('updated_at').desc(), F('id').asc()],
+        )
+    ).filter(row_number__gt=1)
+
+    # Group every copy of each duplicated period and compare their amounts
+    periods = {}
+    for bill in duplicates.values('offline_tenant_id', 'online_tenant_id', 'start_date', 'end_date'):
+        periods[tuple(bill.values())] = []
+    for key in periods:
+        offline_id, online_id, start, end = key
+        periods[key] = list(Billing.objects.filter(
+            offline_tenant_id=offline_id, online_tenant_id=online_id, start_date=start, end_date=end,
+        ).order_by('-updated_at', 'id').values('id', *AMOUNT_FIELDS))
+
+    problems = [
+        f"  unassigned bill #{bill_id} has amount_paid={paid}"
+        for bill_id, paid in unassigned.filter(amount_paid__gt=0).values_list('id', 'amount_paid')
+    ] + [
+        f"  bills {', '.join('#%d' % copy['id'] for copy in copies)} cover the same period "
+        f"{start}..{end} with different amounts"
+        for (_, _, start, end), copies in periods.items()
+        if len({tuple(copy[field] for field in AMOUNT_FIELDS) for copy in copies}) > 1
+    ]
+    if problems:
+        raise RuntimeError(
+            "Cannot add the one-bill-per-period constraints: resolve these bills first "
+            "(delete or correct the wrong copies), then migrate again.\n" + "\n".join(problems)
+        )
+
+    # Identical copies of a period: keep the most recently edited one
+    doomed = list(unassigned.values_list('id', flat=True))
+    affected = list(moved)
+    for (offline_id, online_id, _, _), copies in periods.items():
+        doomed += [copy['id'] for copy in copies[1:]]
+        affected.append((offline_id, online_id))
+
+    for i in range(0, len(doomed), 500):
+        Billing.objects.filter(id__in=doomed[i:i + 500]).delete()
+    DeletedRecord.objects.bulk_create(
+        [DeletedRecord(model_name='billing', object_id=bill_id) for bill_id in doomed], batch_size=500,
+    )
+
+    rebuild_balances(
+        apps,
+        offline_ids={offline_id for offline_id, _ in affected if offline_id},
+        online_ids={online_id for _, online_id in affected if online_id},
+    )
+
+
+def rebuild_balances(apps, offline_ids, online_ids):
+    """Recreate the TenancyBalance rows of the given tenancies from their latest bill."""
+    Billing = apps.get_model('accounts', 'Billing')
+    TenancyBalance = apps.get_model('accounts', 'TenancyBalance')
+
+    for field, ids in (('offline_tenant_id', sorted(offline_ids)), ('online_tenant_id', sorted(online_ids))):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            TenancyBalance.objects.filter(**{f'{field}__in': chunk}).delete()
+            latest = Billing.objects.filter(**{f'{field}__in': chunk}).annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F(field)],
+                    order_by=[F('end_date').desc(), F('id').desc()],
+                )
+            ).filter(row_number=1)
+            TenancyBalance.objects.bulk_create([
+                TenancyBalance(
+                    offline_tenant_id=bill.offline_tenant_id,
+                    online_tenant_id=bill.online_tenant_id,
+                    latest_bill_id=bill.id,
+                    current_due=bill.remaining_due_amount or 0,
+                    last_meter_reading=bill.current_meter_reading or 0,
+                    last_period_end=bill.end_date,
+                )
+                for bill in latest
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0033_tenancybalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(clean_bills, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['offline_tenant', 'end_date'], name='bill_offline_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['online_tenant', 'end_date'], name='bill_online_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['offline_tenant', 'created_at'], name='bill_offline_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['online_tenant', 'created_at'], name='bill_online_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['offline_tenant', 'start_date'], name='bill_offline_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['online_tenant', 'start_date'], name='bill_online_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='billing',
+            constraint=models.UniqueConstraint(fields=('offline_tenant', 'start_date', 'end_date'), name='unique_offline_bill_period'),
+        ),
+        migrations.AddConstraint(
+            model_name='billing',
+            constraint=models.UniqueConstraint(fields=('online_tenant', 'start_date', 'end_date'), name='unique_online_bill_period'),
+        ),
+        migrations.AddConstraint(
+            model_name='billing',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('offline_tenant__isnull', False), ('online_tenant__isnull', True)), models.Q(('offline_tenant__isnull', True), ('online_tenant__isnull', False)), _connector='OR'), name='bill_has_exactly_one_tenant'),
+        ),
+    ]
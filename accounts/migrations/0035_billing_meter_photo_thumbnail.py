@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0034_billing_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billing',
+            name='meter_photo_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='meter_photos/thumbs/'),
+        ),
+    ]
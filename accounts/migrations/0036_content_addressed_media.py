@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:14
+
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0035_billing_meter_photo_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refs', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='billing',
+            name='meter_photo',
+            field=models.ImageField(blank=True, null=True, storage=accounts.storage.content_storage, upload_to='meter_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='billing',
+            name='meter_photo_thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=accounts.storage.content_storage, upload_to='meter_photos/thumbs/'),
+        ),
+        migrations.AlterField(
+            model_name='tenantdocument',
+            name='file',
+            field=models.FileField(storage=accounts.storage.content_storage, upload_to='tenant_documents/'),
+        ),
+    ]
@@ -1,9 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser 
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
+from django.utils import timezone
+from .storage import content_storage
 # Create your models here.
     
 class CustomUser(AbstractUser):
@@ -65,6 +67,7 @@ class LinkTenantLandlord(models.Model):
     start_date = models.DateField(null=True, blank=True)
     end_date = models.DateField(null=True, blank=True)
     note = models.TextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.tenant.username} - tenant of {self.landlord.username}"
@@ -94,35 +97,83 @@ class LinkRequest(models.Model):
     note = models.TextField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.sender.username} → {self.receiver.username} ({self.status})'
 
+    # ------------------ Status transitions ------------------
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so save() can spot a transition without re-reading the row
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def link_fields(self):
+        """LinkTenantLandlord values for the tenancy this invite proposes."""
+        return {
+            "property_name": self.property_name or "",
+            "rent": self.rent or 0,
+            "due_amount": self.due_amount or 0,
+            "meter_rate": self.meter_rate or 0,
+            "starting_meter_reading": self.starting_meter_reading or 0,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "note": self.note or "",
+        }
+
     def save(self, *args, **kwargs):
-        creating = self.pk is None
-        old_status = None
-        if not creating:
-            old_status = LinkRequest.objects.get(pk=self.pk).status
-
-        super().save(*args, **kwargs)
-
-        # when tenant accepts → create link with landlord details
-        if self.status == 'accepted' and old_status != 'accepted':
-            from .models import LinkTenantLandlord
-            LinkTenantLandlord.objects.get_or_create(
-                landlord=self.sender,
-                tenant=self.receiver,
-                defaults={
-                    "property_name": self.property_name or "",
-                    "rent": self.rent or 0,
-                    "due_amount": self.due_amount or 0,
-                    "meter_rate": self.meter_rate or 0,
-                    "starting_meter_reading": self.starting_meter_reading or 0,
-                    "start_date": self.start_date,
-                    "end_date": self.end_date,
-                }
+        old_status = getattr(self, '_loaded_status', None)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # when tenant accepts → create link with landlord details
+            if self.status == 'accepted' and old_status != 'accepted':
+                LinkTenantLandlord.objects.get_or_create(
+                    landlord_id=self.sender_id,
+                    tenant_id=self.receiver_id,
+                    defaults=self.link_fields(),
+                )
+        self._loaded_status = self.status
+
+    @classmethod
+    def respond(cls, receiver, invite_ids, accept):
+        """
+        Accept or reject any number of the receiver's pending invites at once.
+
+        The transition is one conditional UPDATE ... WHERE status='pending', so
+        an invite answered concurrently (another tab, the admin) is neither
+        flipped twice nor linked twice. Accepting then creates the missing
+        landlord links in one bulk INSERT. Returns the invites that changed.
+        """
+        status = 'accepted' if accept else 'rejected'
+        stamp = timezone.now()
+        with transaction.atomic():
+            cls.objects.filter(receiver=receiver, id__in=invite_ids, status='pending').update(
+                status=status, updated_at=stamp,
             )
+            # Rows this call flipped carry its timestamp; the rest were already answered
+            changed = list(
+                cls.objects.filter(receiver=receiver, id__in=invite_ids, status=status, updated_at=stamp)
+                .select_related('sender')
+            )
+
+            if accept and changed:
+                linked = set(
+                    LinkTenantLandlord.objects.filter(
+                        tenant=receiver, landlord_id__in=[invite.sender_id for invite in changed],
+                    ).values_list('landlord_id', flat=True)
+                )
+                new_links = {}
+                for invite in changed:
+                    if invite.sender_id not in linked:
+                        new_links.setdefault(invite.sender_id, LinkTenantLandlord(
+                            landlord_id=invite.sender_id, tenant=receiver, **invite.link_fields(),
+                        ))
+                LinkTenantLandlord.objects.bulk_create(new_links.values())
+        return changed
 
 
 class LandlordRequest(models.Model):
@@ -163,6 +214,7 @@ class OfflineTenants(models.Model):
     start_date = models.DateField(null=True, blank=True)
     end_date = models.DateField(null=True, blank=True)
     note = models.TextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -193,7 +245,11 @@ class Billing(models.Model):
     # starting_meter_reading = models.IntegerField(default=0)
     previous_meter_reading = models.IntegerField(default=0)
     current_meter_reading = models.IntegerField(null=True, blank=True)
-    meter_photo = models.ImageField(upload_to='meter_photos/', null=True, blank=True)
+    meter_photo = models.ImageField(upload_to='meter_photos/', storage=content_storage, null=True, blank=True)
+    # Small JPEG for lists and previews, made by accounts.photos after upload
+    meter_photo_thumbnail = models.ImageField(
+        upload_to='meter_photos/thumbs/', storage=content_storage, null=True, blank=True
+    )
     meter_rate = models.IntegerField(default=0)
 
     misc_charge = models.IntegerField(default=0)
@@ -207,7 +263,36 @@ class Billing(models.Model):
     status = models.CharField(max_length=25, choices=STATUS_CHOICES, default='unpaid')
 
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Latest bill / next period (scheduler, ledger, balance snapshots)
+            models.Index(fields=['offline_tenant', 'end_date'], name='bill_offline_end_idx'),
+            models.Index(fields=['online_tenant', 'end_date'], name='bill_online_end_idx'),
+            # Bill lists and pruning (view_bill, delete_export)
+            models.Index(fields=['offline_tenant', 'created_at'], name='bill_offline_created_idx'),
+            models.Index(fields=['online_tenant', 'created_at'], name='bill_online_created_idx'),
+            # Later bills of a tenancy (bill_detail ledger recompute)
+            models.Index(fields=['offline_tenant', 'start_date'], name='bill_offline_start_idx'),
+            models.Index(fields=['online_tenant', 'start_date'], name='bill_online_start_idx'),
+        ]
+        constraints = [
+            # One bill per tenancy and period; NULL tenants never collide
+            models.UniqueConstraint(
+                fields=['offline_tenant', 'start_date', 'end_date'], name='unique_offline_bill_period'
+            ),
+            models.UniqueConstraint(
+                fields=['online_tenant', 'start_date', 'end_date'], name='unique_online_bill_period'
+            ),
+            models.CheckConstraint(
+                condition=(
+                    models.Q(offline_tenant__isnull=False, online_tenant__isnull=True)
+                    | models.Q(offline_tenant__isnull=True, online_tenant__isnull=False)
+                ),
+                name='bill_has_exactly_one_tenant',
+            ),
+        ]
 
     # ------------------ Validation ------------------
     def clean(self):
@@ -236,12 +321,8 @@ class Billing(models.Model):
         return self.total_bill_amount - (self.amount_paid or 0)
 
     # ------------------ Status Update ------------------
-    def save(self, *args, **kwargs):
-    # Set current_meter_reading for new bills if not provided
-        if not self.pk and self.current_meter_reading is None:
-            self.current_meter_reading = self.previous_meter_reading or 0
-
-        # Always recalculate total_amount
+    def recalculate(self):
+        """Refresh total_amount, remaining_due_amount and status from the bill's inputs."""
         self.total_amount = (
             (self.rent or 0)
             + (self.previous_due_amount or 0)
@@ -249,7 +330,7 @@ class Billing(models.Model):
             + (self.misc_charge or 0)
         )
 
-        # Always recalculate remaining due
+        # Remaining due may go negative (advance payment)
         self.remaining_due_amount = self.total_amount - (self.amount_paid or 0)
 
         # Update status based on remaining due
@@ -260,7 +341,17 @@ class Billing(models.Model):
         else:
             self.status = 'unpaid'
 
-        super().save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+    # Set current_meter_reading for new bills if not provided
+        if not self.pk and self.current_meter_reading is None:
+            self.current_meter_reading = self.previous_meter_reading or 0
+
+        # Always recalculate totals and status
+        self.recalculate()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            TenancyBalance.refresh_for(self.offline_tenant_id, self.online_tenant_id)
 
     # ------------------ String Representation ------------------
     def __str__(self):
@@ -271,6 +362,60 @@ class Billing(models.Model):
         return "Unassigned Bill"
     
 
+# ------------------ Balance Snapshot ------------------
+class TenancyBalance(models.Model):
+    """
+    What a tenancy owes right now, copied from its latest bill (by end_date).
+
+    Kept in step by Billing.save, the ledger recompute and the bill
+    generator; tenancies without bills have no row and fall back to their
+    own due_amount / starting_meter_reading. `manage.py rebuild_balances`
+    rebuilds or verifies the whole table.
+    """
+    offline_tenant = models.OneToOneField(
+        'OfflineTenants', related_name='balance',
+        null=True, blank=True, on_delete=models.CASCADE
+    )
+    online_tenant = models.OneToOneField(
+        'LinkTenantLandlord', related_name='balance',
+        null=True, blank=True, on_delete=models.CASCADE
+    )
+    # No DB constraint: bill pruning deletes rows with raw SQL and rebuilds afterwards
+    latest_bill = models.ForeignKey(
+        Billing, related_name='+', db_constraint=False,
+        null=True, blank=True, on_delete=models.DO_NOTHING
+    )
+    current_due = models.IntegerField(default=0)
+    last_meter_reading = models.IntegerField(default=0)
+    last_period_end = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def values_from_bill(cls, bill):
+        return {
+            'latest_bill_id': bill.id,
+            'current_due': bill.remaining_due_amount or 0,
+            'last_meter_reading': bill.current_meter_reading or 0,
+            'last_period_end': bill.end_date,
+        }
+
+    @classmethod
+    def refresh_for(cls, offline_tenant_id=None, online_tenant_id=None):
+        """Re-read one tenancy's latest bill into its snapshot row."""
+        tenancy = (
+            {'offline_tenant_id': offline_tenant_id} if offline_tenant_id
+            else {'online_tenant_id': online_tenant_id}
+        )
+        latest = Billing.objects.filter(**tenancy).order_by('-end_date', '-id').first()
+        if latest is None:
+            cls.objects.filter(**tenancy).delete()
+        else:
+            cls.objects.update_or_create(**tenancy, defaults=cls.values_from_bill(latest))
+
+    def __str__(self):
+        return f"Balance {self.current_due} (bill #{self.latest_bill_id})"
+
+
 User = get_user_model()
 
 class ChatMessage(models.Model):
@@ -279,9 +424,14 @@ class ChatMessage(models.Model):
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Conversation lookups: one direction of a sender/receiver pair, in time order
+            models.Index(fields=['sender', 'receiver', 'timestamp'], name='chat_pair_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} → {self.receiver.username} : {self.message[:20]}"
@@ -293,8 +443,69 @@ class TenantDocument(models.Model):
     offline_tenant = models.ForeignKey('OfflineTenants', on_delete=models.CASCADE, blank=True, null=True)
     online_tenant = models.ForeignKey(CustomUser, on_delete=models.CASCADE, blank=True, null=True)
     document_name = models.CharField(max_length=200)
-    file = models.FileField(upload_to="tenant_documents/")
+    file = models.FileField(upload_to="tenant_documents/", storage=content_storage)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return self.document_name
\ No newline at end of file
+        return self.document_name
+
+
+# ------------------ Media blobs ------------------
+class MediaBlob(models.Model):
+    """Reference count of one content-addressed file (see accounts.storage)."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    refs = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refs} refs)"
+
+
+class DeletedRecord(models.Model):
+    """Tombstone left behind when a synced row is deleted, for delta exports."""
+    model_name = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id} deleted at {self.deleted_at}"
+
+
+class ScheduledJob(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    # Watermark: the last calendar day this job completed successfully
+    last_success_date = models.DateField(null=True, blank=True)
+    # Lease: only the process named here may run the job until it expires
+    lease_owner = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} (last run {self.last_success_date or 'never'})"
+
+
+class ScheduledJobRun(models.Model):
+    job = models.ForeignKey(ScheduledJob, related_name='runs', on_delete=models.CASCADE)
+    owner = models.CharField(max_length=255)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows_created = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.job.name} run by {self.owner} at {self.started_at}"
+
+
+class LoginFailure(models.Model):
+    """Failed logins per client IP or account in the current window (see accounts.throttle)."""
+    key = models.CharField(max_length=255, unique=True)
+    failures = models.IntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.failures} failures until {self.expires_at}"
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class MessageNotifier:
+    """
+    In-process wake-up channel for chat long-polls.
+
+    Async views subscribe an asyncio.Event per waiting request; publish()
+    may be called from any thread (e.g. a sync view) and sets the events on
+    their own loops. Only waiters in the same process are woken, so other
+    processes fall back to the long-poll timeout.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    def subscribe(self, user_id):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters[user_id].add(waiter)
+        return waiter
+
+    def unsubscribe(self, user_id, waiter):
+        with self._lock:
+            waiters = self._waiters.get(user_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[user_id]
+
+    def publish(self, user_id):
+        with self._lock:
+            waiters = list(self._waiters.get(user_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # the request's loop already closed
+
+
+notifier = MessageNotifier()
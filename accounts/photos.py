@@ -0,0 +1,90 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import Billing
+
+# Uploads above this are refused before anything is stored
+MAX_UPLOAD_BYTES = getattr(settings, "METER_PHOTO_MAX_UPLOAD_BYTES", 15 * 1024 * 1024)
+# Longest side and JPEG quality of the stored photo and of its thumbnail
+MAX_SIDE = getattr(settings, "METER_PHOTO_MAX_SIDE", 1600)
+QUALITY = getattr(settings, "METER_PHOTO_QUALITY", 80)
+THUMBNAIL_SIDE = getattr(settings, "METER_PHOTO_THUMBNAIL_SIDE", 320)
+THUMBNAIL_QUALITY = 70
+WORKERS = getattr(settings, "METER_PHOTO_WORKERS", 2)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _encode(image, side, quality):
+    """JPEG bytes of `image` scaled to fit side x side. No EXIF is written."""
+    image = image.copy()
+    image.thumbnail((side, side), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def process_meter_photo(bill_id, original_name):
+    """
+    Re-encode a bill's uploaded meter photo and give it a thumbnail.
+
+    The original is decoded at reduced size where the format allows it
+    (JPEG draft mode), rotated upright from its EXIF orientation, and saved
+    as a bounded JPEG with the metadata (GPS included) dropped. The bill row
+    is only pointed at the new files if it still holds `original_name`, so a
+    photo replaced or removed in the meantime is left alone.
+    """
+    storage = Billing._meta.get_field("meter_photo").storage
+    with storage.open(original_name, "rb") as f:
+        image = Image.open(f)
+        image.draft("RGB", (MAX_SIDE, MAX_SIDE))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+    stem = os.path.splitext(os.path.basename(original_name))[0]
+    photo_name = storage.save(
+        f"meter_photos/{stem}.jpg", ContentFile(_encode(image, MAX_SIDE, QUALITY))
+    )
+    thumbnail_name = storage.save(
+        f"meter_photos/thumbs/{stem}.jpg", ContentFile(_encode(image, THUMBNAIL_SIDE, THUMBNAIL_QUALITY))
+    )
+
+    updated = Billing.objects.filter(id=bill_id, meter_photo=original_name).update(
+        meter_photo=photo_name, meter_photo_thumbnail=thumbnail_name, updated_at=timezone.now(),
+    )
+    if updated:
+        # Release the upload's reference (content storage counts the new one separately)
+        storage.delete(original_name)
+    else:
+        storage.delete(photo_name)
+        storage.delete(thumbnail_name)
+
+
+def _run(bill_id, original_name):
+    try:
+        process_meter_photo(bill_id, original_name)
+    except Exception as e:
+        print(f"[{date.today()}] Meter photo processing failed for bill {bill_id}: {e}")
+    finally:
+        connections.close_all()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="meter-photo")
+        return _executor
+
+
+def schedule_meter_photo(bill):
+    """Process the bill's freshly saved photo on the worker pool once the transaction commits."""
+    bill_id, name = bill.id, bill.meter_photo.name
+    transaction.on_commit(lambda: _pool().submit(_run, bill_id, name))
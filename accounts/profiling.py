@@ -0,0 +1,62 @@
+import re
+import time
+from collections import Counter
+
+# Literals and placeholder lists that vary between otherwise identical statements
+_IN_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """Collapse a statement to its template: literals become ?, IN lists become (...)."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+class QueryProfile:
+    """
+    A connection.execute_wrapper that records every statement run while it
+    is installed: count, total time, and time and repeats per fingerprint.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.templates = Counter()      # fingerprint -> executions
+        self.template_time = Counter()  # fingerprint -> seconds
+        self.exact = Counter()          # (sql, params) -> executions
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            template = fingerprint(sql)
+            self.count += 1
+            self.duration += elapsed
+            self.templates[template] += 1
+            self.template_time[template] += elapsed
+            if not many:
+                self.exact[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """Fingerprints executed more than once (the N+1 signature), most repeated first."""
+        return [(template, n) for template, n in self.templates.most_common() if n > 1]
+
+    @property
+    def exact_duplicates(self):
+        """Number of statements that repeated an earlier one with the same parameters."""
+        return sum(n - 1 for n in self.exact.values())
+
+    def top_templates(self, limit=5):
+        """[(fingerprint, executions, seconds)] ordered by time spent."""
+        return [
+            (template, self.templates[template], seconds)
+            for template, seconds in self.template_time.most_common(limit)
+        ]
@@ -0,0 +1,145 @@
+from django.db.models import BooleanField, CharField, Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce, Concat, Lower, Trim
+from .models import LinkRequest, LinkTenantLandlord, OfflineTenants
+
+# Columns shared by every part of the roster UNION, in SELECT order
+ROSTER_COLUMNS = [
+    'r_sort', 'r_id', 'r_type_label', 'r_status', 'r_name', 'r_username', 'r_phone',
+    'r_property', 'r_rent', 'r_due', 'r_meter', 'r_start', 'r_end', 'r_note',
+    'r_online', 'r_pending',
+]
+
+
+def _from_balance(snapshot_field, fallback_field):
+    """A TenancyBalance column, or the tenancy's own value while it has no bills."""
+    return Case(
+        When(balance__latest_bill__isnull=False, then=F(f'balance__{snapshot_field}')),
+        default=Coalesce(F(fallback_field), 0),
+        output_field=IntegerField(),
+    )
+
+
+def _display_name(prefix):
+    """SQL version of CustomUser.full_name for the user at `prefix`."""
+    return Case(
+        When(
+            Q(**{f'{prefix}__first_name': ''}) & Q(**{f'{prefix}__last_name': ''}),
+            then=F(f'{prefix}__username'),
+        ),
+        default=Trim(Concat(F(f'{prefix}__first_name'), Value(' '), F(f'{prefix}__last_name'))),
+        output_field=CharField(),
+    )
+
+
+def _text(value):
+    return Value(value, output_field=CharField())
+
+
+def _flag(value):
+    return Value(value, output_field=BooleanField())
+
+
+def _filter_due(qs, due_filter):
+    if due_filter == "pending":
+        return qs.filter(r_due__gt=0)
+    if due_filter == "extra":
+        return qs.filter(r_due__lt=0)
+    if due_filter == "clear":
+        return qs.filter(r_due=0)
+    return qs
+
+
+def tenant_roster(landlord, query="", due_filter=""):
+    """
+    Offline tenants, online tenants and pending invites of `landlord` as one
+    ordered UNION query, with each tenancy's due joined from its TenancyBalance.
+    """
+    offline = OfflineTenants.objects.filter(landlord=landlord)
+    if query:
+        offline = offline.filter(Q(name__icontains=query) | Q(phone_number__icontains=query))
+    offline = offline.annotate(
+        r_id=F('id'),
+        r_type_label=_text('Offline'),
+        r_status=_text('active'),
+        r_name=F('name'),
+        r_username=_text(''),
+        r_phone=F('phone_number'),
+        r_property=F('property_name'),
+        r_rent=F('rent'),
+        r_due=_from_balance('current_due', 'due_amount'),
+        r_meter=_from_balance('last_meter_reading', 'starting_meter_reading'),
+        r_start=F('start_date'),
+        r_end=F('end_date'),
+        r_note=F('note'),
+        r_online=_flag(False),
+        r_pending=_flag(False),
+        r_sort=Lower('name'),
+    )
+
+    online = LinkTenantLandlord.objects.filter(landlord=landlord)
+    if query:
+        online = online.filter(Q(tenant__username__icontains=query) | Q(tenant__phone_number__icontains=query))
+    online = online.annotate(
+        r_id=F('id'),
+        r_type_label=_text('Online'),
+        r_status=_text('active'),
+        r_name=_display_name('tenant'),
+        r_username=F('tenant__username'),
+        r_phone=F('tenant__phone_number'),
+        r_property=F('property_name'),
+        r_rent=F('rent'),
+        r_due=_from_balance('current_due', 'due_amount'),
+        r_meter=_from_balance('last_meter_reading', 'starting_meter_reading'),
+        r_start=F('start_date'),
+        r_end=F('end_date'),
+        r_note=F('note'),
+        r_online=_flag(True),
+        r_pending=_flag(False),
+        r_sort=Lower(_display_name('tenant')),
+    )
+
+    invites = LinkRequest.objects.filter(sender=landlord, status='pending')
+    if query:
+        invites = invites.filter(Q(receiver__username__icontains=query) | Q(receiver__phone_number__icontains=query))
+    invites = invites.annotate(
+        r_id=F('id'),
+        r_type_label=_text('Online'),
+        r_status=_text('pending'),
+        r_name=_display_name('receiver'),
+        r_username=F('receiver__username'),
+        r_phone=F('receiver__phone_number'),
+        r_property=F('property_name'),
+        r_rent=Coalesce(F('rent'), 0),
+        r_due=Coalesce(F('due_amount'), 0),
+        r_meter=Coalesce(F('starting_meter_reading'), 0),
+        r_start=F('start_date'),
+        r_end=F('end_date'),
+        r_note=_text(''),
+        r_online=_flag(True),
+        r_pending=_flag(True),
+        r_sort=Lower(_display_name('receiver')),
+    )
+
+    parts = [_filter_due(qs, due_filter).values(*ROSTER_COLUMNS) for qs in (offline, online, invites)]
+    roster = parts[0].union(parts[1], parts[2], all=True).order_by('r_sort', 'r_type_label', 'r_id')
+
+    return [
+        {
+            'id': row['r_id'],
+            'type_label': row['r_type_label'],
+            'status': row['r_status'],
+            'name': row['r_name'],
+            'username': row['r_username'],
+            'phone_number': row['r_phone'],
+            'property_name': row['r_property'],
+            'rent': row['r_rent'],
+            'due_amount': row['r_due'],
+            'latest_meter': row['r_meter'],
+            'start_date': row['r_start'],
+            'end_date': row['r_end'],
+            'note': row['r_note'],
+            'is_online': bool(row['r_online']),
+            'pending_invite': bool(row['r_pending']),
+        }
+        for row in roster
+    ]
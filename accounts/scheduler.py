@@ -1,7 +1,27 @@
 import calendar
+import datetime as dt
+import os
+import socket
+import threading
+import time
+import uuid
 from datetime import date, timedelta
-# from apscheduler.schedulers.background import BackgroundScheduler
-from .models import OfflineTenants, LinkTenantLandlord, Billing
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from .ledger import refresh_balances
+from .models import OfflineTenants, LinkTenantLandlord, Billing, ScheduledJob, ScheduledJobRun
+
+DEFAULT_CHUNK_SIZE = 1000
+BILLING_JOB = "generate_bills"
+WATERMARK_CACHE_KEY = "billing:last_success_date"
+LEASE_SECONDS = 15 * 60
+RETRY_CACHE_KEY = "billing:next_attempt_at"
+# After a failed run, or one that found the lease taken, wait this long before triggering again
+RETRY_SECONDS = getattr(settings, "BILLING_RETRY_SECONDS", 5 * 60)
 
 # --- Helper to add one month ---
 def add_one_month(start_date):
@@ -16,75 +36,337 @@ def add_one_month(start_date):
     day = min(start_date.day, last_day_next_month)
     return date(year, month, day)
 
+
+# --- Latest bill per tenancy, in one windowed query ---
+def latest_bills_by_tenancy():
+    """Return {("offline"|"online", tenancy_id): latest bill values} for every tenancy."""
+    ranked = Billing.objects.annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('offline_tenant_id'), F('online_tenant_id')],
+            order_by=[F('end_date').desc(), F('id').desc()],
+        )
+    ).filter(row_number=1).values(
+        'offline_tenant_id', 'online_tenant_id', 'end_date',
+        'current_meter_reading', 'remaining_due_amount',
+    )
+
+    latest = {}
+    for row in ranked:
+        if row['offline_tenant_id'] is not None:
+            latest[("offline", row['offline_tenant_id'])] = row
+        else:
+            latest[("online", row['online_tenant_id'])] = row
+    return latest
+
+
+# --- Compute every due period for one tenancy ---
+def pending_bills_for(tenant_type, tenant, last_bill, today):
+    """Build unsaved Billing rows for every period that has started by `today`."""
+    if last_bill:
+        next_start = last_bill['end_date'] + timedelta(days=1)
+        previous_meter = last_bill['current_meter_reading'] or 0
+        previous_due_amount = last_bill['remaining_due_amount'] or 0
+    else:
+        # For new tenants: always generate first bill
+        next_start = tenant['start_date'] or today
+        previous_meter = tenant['starting_meter_reading']
+        previous_due_amount = tenant['due_amount']
+
+    bills = []
+    while today >= next_start:
+        next_end = add_one_month(next_start) - timedelta(days=1)
+        bill = Billing(
+            offline_tenant_id=tenant['id'] if tenant_type == "offline" else None,
+            online_tenant_id=tenant['id'] if tenant_type == "online" else None,
+            rent=tenant['rent'],
+            meter_rate=tenant['meter_rate'] or 10,
+            previous_meter_reading=previous_meter,
+            current_meter_reading=previous_meter,  # initial reading
+            previous_due_amount=previous_due_amount,
+            start_date=next_start,
+            end_date=next_end,
+        )
+        # bulk_create skips Billing.save, so fill in the derived columns here
+        bill.recalculate()
+        bills.append(bill)
+
+        # Carry forward into the next period
+        next_start = next_end + timedelta(days=1)
+        previous_due_amount = bill.remaining_due_amount
+
+    return bills
+
+
 # --- Generate bills ---
-def generate_bills():
-    today = date.today()
-    bills_created = 0
+def generate_bills(chunk_size=DEFAULT_CHUNK_SIZE, today=None, heartbeat=None):
+    """
+    Create every bill that is due as of `today` for all offline and online tenancies.
 
-    # Combine tenants into a single list with type info
+    Reads the latest bill per tenancy in one query, works out the missing
+    periods in memory and writes them with chunked bulk_create in a single
+    transaction. `heartbeat`, if given, is called before each chunk; raising
+    from it rolls the whole run back. Returns a dict with the counts and the
+    elapsed wall time: `periods_due` counts every missing period found,
+    `bills_created` only the rows actually inserted (a period another run
+    inserted first is skipped).
+    """
+    started = time.monotonic()
+    today = today or date.today()
+    tenant_fields = ('id', 'start_date', 'rent', 'meter_rate', 'starting_meter_reading', 'due_amount')
+
+    latest = latest_bills_by_tenancy()
     tenants = [
-        {"obj": t, "type": "offline"} for t in OfflineTenants.objects.all()
+        ("offline", t) for t in OfflineTenants.objects.values(*tenant_fields)
     ] + [
-        {"obj": t, "type": "online"} for t in LinkTenantLandlord.objects.all()
+        ("online", t) for t in LinkTenantLandlord.objects.values(*tenant_fields)
     ]
 
-    for t in tenants:
-        tenant = t["obj"]
-        tenant_type = t["type"]
+    new_bills = []
+    for tenant_type, tenant in tenants:
+        last_bill = latest.get((tenant_type, tenant['id']))
+        new_bills.extend(pending_bills_for(tenant_type, tenant, last_bill, today))
 
-        # Last bill
-        if tenant_type == "offline":
-            last_bill = tenant.offline_bill.order_by('-end_date').first()
-        else:
-            last_bill = tenant.online_bill.order_by('-end_date').first()
+    with transaction.atomic():
+        # ignore_conflicts reports no row counts; the lease keeps other runs out meanwhile
+        existing = Billing.objects.count()
+        # The per-period unique constraints turn a concurrent duplicate into a no-op
+        for i in range(0, len(new_bills), chunk_size):
+            if heartbeat:
+                heartbeat()
+            Billing.objects.bulk_create(new_bills[i:i + chunk_size], ignore_conflicts=True)
+        inserted = Billing.objects.count() - existing
 
-        # Tenant start date
-        tenant_start_date = getattr(tenant, "start_date", date.today()) or date.today()
+        # Ids are not returned with ignore_conflicts, so re-read the billed tenancies
+        refresh_balances(
+            offline_ids={b.offline_tenant_id for b in new_bills if b.offline_tenant_id},
+            online_ids={b.online_tenant_id for b in new_bills if b.online_tenant_id},
+            chunk_size=chunk_size,
+        )
 
-        # Determine next billing period
-        if last_bill:
-            next_start = last_bill.end_date + timedelta(days=1)
-            next_end = add_one_month(next_start) - timedelta(days=1)
-            previous_meter = last_bill.current_meter_reading or 0
-            previous_due_amount = last_bill.remaining_due_amount or 0
-        else:
-            # For new tenants: always generate first bill
-            next_start = tenant_start_date
-            next_end = add_one_month(next_start) - timedelta(days=1)
-            previous_meter = getattr(tenant, "starting_meter_reading", 0)
-            previous_due_amount = getattr(tenant, "due_amount", 0)
-
-
-        # Only create bill if today >= next_start
-        if today >= next_start:
-            # Check if a bill already exists for this period to avoid duplicates
-            existing_bill = Billing.objects.filter(
-                offline_tenant=tenant if tenant_type == "offline" else None,
-                online_tenant=tenant if tenant_type == "online" else None,
-                start_date=next_start,
-                end_date=next_end
-            ).first()
-
-            if not existing_bill:
-                Billing.objects.create(
-                    offline_tenant=tenant if tenant_type == "offline" else None,
-                    online_tenant=tenant if tenant_type == "online" else None,
-                    rent=tenant.rent,
-                    meter_rate=tenant.meter_rate or 10,
-                    previous_meter_reading=previous_meter,
-                    current_meter_reading=previous_meter,  # initial reading
-                    previous_due_amount=previous_due_amount,
-                    start_date=next_start,
-                    end_date=next_end,
-                )
-                tenant_name = tenant.name if tenant_type == "offline" else tenant.tenant.full_name
-                print(f"Bill created for {tenant_name} ({tenant_type}) from {next_start} to {next_end}")
+    return {
+        "tenants_scanned": len(tenants),
+        "periods_due": len(new_bills),
+        "bills_created": inserted,
+        "tenants_billed": len({(b.offline_tenant_id, b.online_tenant_id) for b in new_bills}),
+        "elapsed_seconds": time.monotonic() - started,
+    }
+
+
+# --- Watermark: last day bills were generated successfully ---
+def billing_watermark(today=None):
+    """Return the last successful billing date, hitting the DB only when the cache looks stale."""
+    today = today or date.today()
+    watermark = cache.get(WATERMARK_CACHE_KEY)
+    if watermark is None or watermark < today:
+        watermark = ScheduledJob.objects.filter(name=BILLING_JOB).values_list(
+            'last_success_date', flat=True
+        ).first()
+        if watermark:
+            cache.set(WATERMARK_CACHE_KEY, watermark, timeout=None)
+    return watermark
+
+
+def mark_billing_done(day):
+    ScheduledJob.objects.update_or_create(name=BILLING_JOB, defaults={'last_success_date': day})
+    cache.set(WATERMARK_CACHE_KEY, day, timeout=None)
+
+
+# --- Lease: one run per job at a time ---
+def run_owner():
+    """A lease owner token unique to one run, even among threads of the same process."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def acquire_lease(name, owner, seconds=LEASE_SECONDS):
+    """Take the job's lease with a conditional UPDATE; True only for the winner."""
+    ScheduledJob.objects.get_or_create(name=name)
+    now = timezone.now()
+    acquired = ScheduledJob.objects.filter(name=name).filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now)
+    ).update(lease_owner=owner, lease_expires_at=now + timedelta(seconds=seconds), updated_at=now)
+    return acquired == 1
+
+
+class LeaseLost(Exception):
+    """The run's lease expired and was taken over by another run."""
+
+
+def renew_lease(name, owner, seconds=LEASE_SECONDS):
+    """Push back the expiry of a lease `owner` still holds; False if it was lost."""
+    now = timezone.now()
+    renewed = ScheduledJob.objects.filter(name=name, lease_owner=owner).update(
+        lease_expires_at=now + timedelta(seconds=seconds), updated_at=now
+    )
+    return renewed == 1
+
+
+def lease_keeper(name, owner, seconds=LEASE_SECONDS):
+    """
+    A heartbeat for generate_bills that renews the lease once a third of it
+    has passed and raises LeaseLost if another run has taken it over.
+    """
+    renewed_at = time.monotonic()
+
+    def heartbeat():
+        nonlocal renewed_at
+        if time.monotonic() - renewed_at < seconds / 3:
+            return
+        if not renew_lease(name, owner, seconds):
+            raise LeaseLost(f"Lease on {name} was lost mid-run")
+        renewed_at = time.monotonic()
+
+    return heartbeat
+
+
+def release_lease(name, owner):
+    ScheduledJob.objects.filter(name=name, lease_owner=owner).update(
+        lease_owner=None, lease_expires_at=None
+    )
+
+
+def run_billing_job(today=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generate bills under the billing lease and record the run.
+
+    Returns the generate_bills result, or None if another process holds the
+    lease. generate_bills covers every period up to today, so a run after
+    downtime catches up all missed days in one pass.
+    """
+    owner = run_owner()
+    if not acquire_lease(BILLING_JOB, owner):
+        return None
+
+    job = ScheduledJob.objects.get(name=BILLING_JOB)
+    # A run left open means its process died while holding an (now expired) lease
+    job.runs.filter(finished_at__isnull=True).update(
+        finished_at=timezone.now(), error="Abandoned: lease expired before the run finished"
+    )
+    run = ScheduledJobRun.objects.create(job=job, owner=owner)
+
+    try:
+        today = today or date.today()
+        result = generate_bills(chunk_size=chunk_size, today=today, heartbeat=lease_keeper(BILLING_JOB, owner))
+        mark_billing_done(today)
+        run.rows_created = result["bills_created"]
+        return result
+    except Exception as e:
+        run.error = str(e)
+        raise
+    finally:
+        run.finished_at = timezone.now()
+        run.save()
+        release_lease(BILLING_JOB, owner)
+
+
+def defer_billing_retry(seconds=RETRY_SECONDS):
+    """Keep trigger_billing_if_due from starting another run for `seconds`."""
+    cache.set(RETRY_CACHE_KEY, time.time() + seconds, timeout=seconds)
+
+
+def billing_retry_deferred():
+    next_attempt_at = cache.get(RETRY_CACHE_KEY)
+    return next_attempt_at is not None and time.time() < next_attempt_at
+
+
+_trigger_lock = threading.Lock()
+_trigger_thread = None
+
+
+def _run_billing_in_background():
+    try:
+        if run_billing_job() is None:
+            defer_billing_retry()
+    except Exception as e:
+        defer_billing_retry()
+        print(f"[{date.today()}] Background billing failed: {e}")
+    finally:
+        connections.close_all()
+
+
+def trigger_billing_if_due():
+    """
+    Start a background billing run if the calendar day has moved past the
+    watermark and no recent failure has deferred the next attempt.
+
+    Returns True when a run was started. At most one run is in flight per
+    process, and only server processes (where the scheduler was started) run any.
+    """
+    global _trigger_thread
+    if _scheduler_thread is None:
+        return False
+    watermark = billing_watermark()
+    if watermark and watermark >= date.today():
+        return False
+    if billing_retry_deferred():
+        return False
+
+    with _trigger_lock:
+        if _trigger_thread is not None and _trigger_thread.is_alive():
+            return False
+        _trigger_thread = threading.Thread(target=_run_billing_in_background, daemon=True)
+        _trigger_thread.start()
+    return True
 
 
 # --- Start scheduler ---
-# def start_scheduler(test_mode=False):
-#     scheduler = BackgroundScheduler()
-#     interval_seconds = 10 if test_mode else 86400  # 1 day
-#     scheduler.add_job(generate_bills, 'interval', seconds=interval_seconds, id='generate_bills')
-#     scheduler.start()
-#     print(f"Scheduler started ({'test mode' if test_mode else 'daily mode'})")
+def scheduler_enabled():
+    """
+    Opt out with settings.BILLING_SCHEDULER_ENABLED = False or the
+    BILLING_SCHEDULER=0 environment variable.
+
+    The scheduler is started from config.wsgi and config.asgi, which only
+    servers (runserver included) import, so management commands and test
+    runners never start it however they are invoked.
+    """
+    if not getattr(settings, "BILLING_SCHEDULER_ENABLED", True):
+        return False
+    if os.environ.get("BILLING_SCHEDULER", "1") == "0":
+        return False
+    return True
+
+
+def _seconds_until_next_run(test_mode):
+    if test_mode:
+        return 10  # every 10 seconds
+    # Sleep until next day at 00:01
+    tomorrow = date.today() + timedelta(days=1)
+    next_run = dt.datetime.combine(tomorrow, dt.time(hour=0, minute=1))
+    return max((next_run - dt.datetime.now()).total_seconds(), 0)
+
+
+def _scheduler_loop():
+    test_mode = os.environ.get("BILL_TEST_MODE", "0") == "1"
+
+    while True:
+        now = dt.datetime.now()
+        try:
+            watermark = billing_watermark()
+            # Catch up immediately after downtime; otherwise wait for the next day
+            if test_mode or not watermark or watermark < date.today():
+                result = run_billing_job()
+                if result is None:
+                    defer_billing_retry()
+                    print(f"[{now}] Billing lease held by another run, skipping")
+                else:
+                    print(f"[{now}] Created {result['bills_created']} bills")
+        except Exception as e:
+            defer_billing_retry()
+            print(f"[{now}] Error: {e}")
+        finally:
+            connections.close_all()
+
+        time.sleep(_seconds_until_next_run(test_mode))
+
+
+_scheduler_thread = None
+
+
+def start_scheduler():
+    """Start the daily billing thread once per process, if enabled."""
+    global _scheduler_thread
+    if _scheduler_thread is not None or not scheduler_enabled():
+        return False
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, daemon=True)
+    _scheduler_thread.start()
+    return True
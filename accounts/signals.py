@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from .models import (
+    Billing, ChatMessage, DeletedRecord, LinkRequest, LinkTenantLandlord, OfflineTenants, TenancyBalance,
+    TenantDocument,
+)
+
+# Models whose deletions delta exports must report
+TRACKED_MODELS = (Billing, LinkRequest, OfflineTenants, LinkTenantLandlord, ChatMessage)
+
+
+def record_tombstone(sender, instance, **kwargs):
+    DeletedRecord.objects.create(model_name=sender._meta.model_name, object_id=instance.pk)
+
+
+# Connected per model: a sender-less receiver would disable fast deletes everywhere
+for model in TRACKED_MODELS:
+    post_delete.connect(record_tombstone, sender=model, dispatch_uid=f"tombstone-{model._meta.model_name}")
+
+
+def refresh_balance(sender, instance, **kwargs):
+    # latest_bill has no DB constraint, so nothing else notices its bill going away.
+    # Only the latest bill feeds the snapshot; deleting an older one changes nothing.
+    if TenancyBalance.objects.filter(latest_bill_id=instance.pk).exists():
+        TenancyBalance.refresh_for(instance.offline_tenant_id, instance.online_tenant_id)
+
+
+post_delete.connect(refresh_balance, sender=Billing, dispatch_uid="refresh-balance-billing")
+
+
+# File fields whose references are released when their row is deleted (cascades included)
+FILE_FIELDS = {
+    Billing: ('meter_photo', 'meter_photo_thumbnail'),
+    TenantDocument: ('file',),
+}
+
+
+def release_files(sender, instance, **kwargs):
+    for field_name in FILE_FIELDS[sender]:
+        file = getattr(instance, field_name)
+        if file:
+            storage, name = file.storage, file.name
+            # Only once the delete is committed; gc_media removes the blob itself
+            transaction.on_commit(lambda storage=storage, name=name: storage.delete(name))
+
+
+for model in FILE_FIELDS:
+    post_delete.connect(release_files, sender=model, dispatch_uid=f"release-files-{model._meta.model_name}")
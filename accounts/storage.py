@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+# Blobs live at blobs/<first two hex digits>/<sha256><ext>; partial writes in blobs/tmp
+BLOB_DIR = "blobs"
+TMP_DIR = f"{BLOB_DIR}/tmp"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct file once, named by the SHA-256 of its content.
+
+    The upload is hashed while it is streamed to a temporary file (or, for
+    uploads Django already spooled to disk, while it is read back), so no
+    file is held in memory. Saving content that already exists only bumps
+    the blob's reference count in MediaBlob; delete() lowers it. Files are
+    removed by the gc_media command, which also catches rows deleted
+    without going through the storage (raw deletes, failed saves).
+
+    Files saved before this storage keep their old names and are deleted
+    directly, as FileSystemStorage would.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content; the suggested one only lends its extension
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        digest = hashlib.sha256()
+        size = 0
+
+        if hasattr(content, "temporary_file_path"):
+            source, owned = content.temporary_file_path(), False
+            for chunk in content.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+        else:
+            os.makedirs(self.path(TMP_DIR), exist_ok=True)
+            fd, source = tempfile.mkstemp(dir=self.path(TMP_DIR))
+            owned = True
+            with os.fdopen(fd, "wb") as out:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+
+        sha = digest.hexdigest()
+        blob_name = f"{BLOB_DIR}/{sha[:2]}/{sha}{extension}"
+        full_path = self.path(blob_name)
+
+        try:
+            # Restart gc_media's grace window: the row about to use it may not be committed yet
+            os.utime(full_path)
+        except FileNotFoundError:  # new content, or just collected by gc_media
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if owned:
+                os.replace(source, full_path)  # Same filesystem: atomic
+            else:
+                file_move_safe(source, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        else:
+            if owned:
+                os.remove(source)
+
+        self._add_reference(blob_name, size)
+        return blob_name
+
+    def _add_reference(self, name, size):
+        from .models import MediaBlob
+
+        if not MediaBlob.objects.filter(name=name).update(refs=F("refs") + 1):
+            try:
+                with transaction.atomic():
+                    MediaBlob.objects.create(name=name, size=size, refs=1)
+            except IntegrityError:  # created concurrently
+                MediaBlob.objects.filter(name=name).update(refs=F("refs") + 1)
+
+    def delete(self, name):
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        if not name.startswith(f"{BLOB_DIR}/"):
+            return super().delete(name)
+
+        from .models import MediaBlob
+
+        MediaBlob.objects.filter(name=name, refs__gt=0).update(refs=F("refs") - 1)
+
+
+content_storage_instance = ContentAddressedStorage()
+
+
+def content_storage():
+    """Storage callable for FileFields, so migrations reference it instead of serializing it."""
+    return content_storage_instance
@@ -0,0 +1,119 @@
+import csv
+import io
+from django.db import transaction
+from django.db.models import Q
+from .forms import InviteTenantForm, OfflineTenantForm
+from .models import CustomUser, LinkRequest, OfflineTenants
+
+MAX_IMPORT_ROWS = 5000
+
+
+class ImportFileError(ValueError):
+    """The upload could not be read as a tenant CSV at all."""
+
+
+def read_csv(data):
+    """Rows of a CSV upload (bytes or text) as dicts keyed by the header row."""
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')  # Excel writes a BOM
+        except UnicodeDecodeError:
+            raise ImportFileError("The file must be a UTF-8 CSV (XLSX is not supported; save it as CSV).")
+    reader = csv.DictReader(io.StringIO(data))
+    if not reader.fieldnames:
+        raise ImportFileError("The file is empty.")
+    rows = [
+        {(key or '').strip(): (value or '').strip() for key, value in row.items()}
+        for row in reader
+    ]
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ImportFileError(f"At most {MAX_IMPORT_ROWS} rows can be imported at once.")
+    return rows
+
+
+def import_tenants(landlord, rows, dry_run=False):
+    """
+    Validate and create offline tenants and invites for `landlord` from CSV rows.
+
+    A row with a username_or_phone is an invite and is checked with
+    InviteTenantForm; any other row is an offline tenant checked with
+    OfflineTenantForm. Invitees are resolved with one username-or-phone IN
+    query and pending invites with one more. Nothing is written unless every
+    row is valid, so a corrected file can simply be uploaded again.
+
+    Returns {"created": bool, "offline": n, "invites": n, "rows": [...]}
+    with one {"row", "kind", "errors"} entry per data row (row 2 is the
+    first line after the header).
+    """
+    report, offline, invites = [], [], []
+    for number, row in enumerate(rows, start=2):
+        if row.get('username_or_phone'):
+            form = InviteTenantForm(data=row)
+            kind = 'invite'
+        else:
+            form = OfflineTenantForm(data=row)
+            kind = 'offline'
+        errors = {} if form.is_valid() else {field: list(msgs) for field, msgs in form.errors.items()}
+        report.append({"row": number, "kind": kind, "errors": errors})
+        if not errors:
+            (invites if kind == 'invite' else offline).append((report[-1], form))
+
+    # --- Resolve invitees in one query ---
+    identifiers = {form.cleaned_data['username_or_phone'] for _, form in invites}
+    by_username, by_phone = {}, {}
+    for user in CustomUser.objects.filter(Q(username__in=identifiers) | Q(phone_number__in=identifiers)):
+        by_username[user.username] = user
+        if user.phone_number:
+            by_phone[user.phone_number] = user
+
+    pending = set(
+        LinkRequest.objects.filter(
+            sender=landlord, status='pending',
+            receiver__in=list(by_username.values()) + list(by_phone.values()),
+        ).values_list('receiver_id', flat=True)
+    )
+
+    new_invites, invited = [], set()
+    for entry, form in invites:
+        data = form.cleaned_data
+        identifier = data['username_or_phone']
+        tenant_user = by_username.get(identifier) or by_phone.get(identifier)
+        if tenant_user is None:
+            entry["errors"]["username_or_phone"] = ["No tenant exists with this username or phone number."]
+        elif tenant_user.id in pending:
+            entry["errors"]["username_or_phone"] = [f"An invite is already pending for {tenant_user.username}."]
+        elif tenant_user.id in invited:
+            entry["errors"]["username_or_phone"] = [f"{tenant_user.username} is invited twice in this file."]
+        else:
+            invited.add(tenant_user.id)
+            new_invites.append(LinkRequest(
+                sender=landlord,
+                receiver=tenant_user,
+                status='pending',
+                property_name=data.get('property_name') or "",
+                rent=data.get('rent') or 0,
+                due_amount=data.get('due_amount') or 0,
+                meter_rate=data.get('meter_rate') or 10,
+                starting_meter_reading=data.get('starting_meter_reading') or 0,
+                start_date=data.get('start_date'),
+                note=data.get('note') or "",
+            ))
+
+    new_offline = []
+    for _, form in offline:
+        tenant = form.save(commit=False)
+        tenant.landlord = landlord
+        new_offline.append(tenant)
+
+    valid = not any(entry["errors"] for entry in report)
+    if valid and not dry_run:
+        with transaction.atomic():
+            OfflineTenants.objects.bulk_create(new_offline)
+            LinkRequest.objects.bulk_create(new_invites)
+
+    return {
+        "created": valid and not dry_run,
+        "offline": len(new_offline),
+        "invites": len(new_invites),
+        "rows": report,
+    }
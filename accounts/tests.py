@@ -1,3 +1,1311 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, timedelta
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from .ledger import recompute_following
+from .management.commands.gc_media import remove_if_unused
+from .management.commands.export import CHECKPOINT_OVERLAP, SECTIONS
+from .middleware import QueryProfilingMiddleware
+from .models import (
+    Billing, ChatMessage, CustomUser, LinkRequest, LinkTenantLandlord, LoginFailure, MediaBlob,
+    OfflineTenants, ScheduledJob, ScheduledJobRun, TenancyBalance, TenantDocument,
+)
+from .photos import process_meter_photo
+from .scheduler import (
+    BILLING_JOB, LeaseLost, acquire_lease, billing_watermark, generate_bills, release_lease, renew_lease,
+    run_billing_job,
+)
+from .roster import tenant_roster
+from .storage import content_storage
+from .tenant_import import import_tenants, read_csv
+from .throttle import LOGIN_FAILURES_PER_ACCOUNT, LOGIN_FAILURES_PER_IP
+
+# Tenancies owned by the benchmarked landlord at each step; override with
+# e.g. BENCH_SCALES=10,1000,50000 for a full production-size run.
+SCALES = [int(s) for s in os.environ.get("BENCH_SCALES", "10,1000").split(",")]
+# Requests timed per route and scale
+REPEAT = int(os.environ.get("BENCH_REPEAT", "5"))
+# Monthly bills per tenancy: 2023-01 .. 2024-12
+BILLING_START = date(2023, 1, 1)
+BILLING_TODAY = date(2024, 12, 1)
+
+
+def seed_dataset(landlord, tenant, tenancies):
+    """
+    Grow `landlord`'s portfolio to `tenancies` tenancies (half offline, half
+    online) with two years of bills, plus chat history and invites for
+    `tenant` that scale with it. Safe to call repeatedly with larger sizes.
+    """
+    online_target = tenancies // 2
+    offline_target = tenancies - online_target
+
+    existing_offline = OfflineTenants.objects.filter(landlord=landlord).count()
+    offline = OfflineTenants.objects.bulk_create([
+        OfflineTenants(
+            landlord=landlord, name=f"Offline {i}", phone_number=f"9{i:09d}", property_name=f"Unit {i}",
+            rent=5000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=BILLING_START,
+        )
+        for i in range(existing_offline, offline_target)
+    ])
+    TenantDocument.objects.bulk_create([
+        TenantDocument(tenant_type="offline", offline_tenant=t, document_name="Lease",
+                       file=f"tenant_documents/lease-{t.id}.pdf")
+        for t in offline
+    ])
+
+    existing_online = LinkTenantLandlord.objects.filter(landlord=landlord).count()
+    users = CustomUser.objects.bulk_create([
+        CustomUser(username=f"tenant{i}", role="tenant", phone_number=f"8{i:09d}")
+        for i in range(max(existing_online, 1), online_target)
+    ])
+    LinkTenantLandlord.objects.bulk_create([
+        LinkTenantLandlord(
+            landlord=landlord, tenant=user, property_name=f"Flat {user.id}",
+            rent=7000, meter_rate=10, start_date=BILLING_START,
+        )
+        for user in users
+    ])
+
+    # The benchmarked tenant's inbox grows with the dataset too
+    existing_invites = LinkRequest.objects.filter(receiver=tenant).count()
+    senders = CustomUser.objects.bulk_create([
+        CustomUser(username=f"landlord{i}", role="landlord", phone_number=f"7{i:09d}")
+        for i in range(existing_invites, max(1, tenancies // 10))
+    ])
+    LinkRequest.objects.bulk_create([
+        LinkRequest(sender=sender, receiver=tenant, status="pending", property_name="Flat", rent=6000)
+        for sender in senders
+    ])
+
+    existing_messages = ChatMessage.objects.filter(sender__in=[landlord, tenant]).count()
+    ChatMessage.objects.bulk_create([
+        ChatMessage(
+            sender=landlord if i % 2 else tenant, receiver=tenant if i % 2 else landlord,
+            message=f"Message {i}",
+        )
+        for i in range(existing_messages, tenancies * 5)
+    ])
+
+    generate_bills(today=BILLING_TODAY)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class ViewScalingBenchmark(TestCase):
+    """
+    Hit every read-only route in accounts/urls.py at each dataset scale and
+    record query count, p50/p95 latency and peak traced memory. A route whose
+    query count changes between scales has an N+1 and fails its test.
+
+    Routes that only mutate (logout, landlord_request, the delete_* views,
+    update_tenant_note, send_message, register_as_tenant) are left out.
+    Set BENCH_REPORT=<path> to write the measurements as a table.
+    """
+
+    @classmethod
+    def routes(cls):
+        offline = OfflineTenants.objects.filter(landlord=cls.landlord).order_by("id").first()
+        link = LinkTenantLandlord.objects.get(landlord=cls.landlord, tenant=cls.tenant)
+        bill = Billing.objects.filter(offline_tenant=offline).order_by("start_date").first()
+        return {
+            # name: (client, url)
+            "home": (cls.anonymous, reverse("home")),
+            "login": (cls.anonymous, reverse("login")),
+            "signup": (cls.anonymous, reverse("signup")),
+            "dashboard": (cls.landlord_client, reverse("dashboard")),
+            "landlord_dashboard": (cls.landlord_client, reverse("landlord_dashboard")),
+            "tenant_dashboard": (cls.tenant_client, reverse("tenant_dashboard")),
+            "guest_dashboard": (cls.guest_client, reverse("guest_dashboard")),
+            "manage_tenants": (cls.landlord_client, reverse("manage_tenants")),
+            "update_tenant": (cls.landlord_client, reverse("update_tenant", args=[offline.id])),
+            "tenant_invites": (cls.tenant_client, reverse("tenant_invites")),
+            "view_bill": (cls.landlord_client, reverse("view_bill", args=[link.id, "Online"])),
+            "bill_detail": (cls.landlord_client, reverse("bill_detail", args=[bill.id])),
+            "chat": (cls.landlord_client, reverse("chat")),
+            "fetch_messages": (cls.landlord_client, reverse("fetch_messages", args=[cls.tenant.id])),
+            "wait_for_messages": (cls.landlord_client, reverse("wait_for_messages", args=[cls.tenant.id])),
+            "documents_dashboard": (cls.landlord_client, reverse("documents_dashboard")),
+            "tenant_documents": (cls.landlord_client, reverse("tenant_documents", args=[offline.id, "offline"])),
+            "all_bills": (cls.landlord_client, reverse("all_bills")),
+            "all_bills_json": (cls.landlord_client, reverse("all_bills_json")),
+            "tenant_all_bills": (cls.tenant_client, reverse("all_bills")),
+            "profile": (cls.landlord_client, reverse("profile")),
+            "password_change": (cls.landlord_client, reverse("password_change")),
+        }
+
+    @classmethod
+    def measure(cls, client, url):
+        latencies = []
+        for _ in range(REPEAT):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - started)
+            query_count = len(queries.captured_queries)
+        assert response.status_code in (200, 302), f"{url} returned {response.status_code}"
+
+        tracemalloc.start()
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            "queries": query_count,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "peak_kb": peak / 1024,
+        }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user(username="landlord", password="x", role="landlord")
+        cls.tenant = CustomUser.objects.create_user(
+            username="tenant0", password="x", role="tenant", phone_number="8000000000"
+        )
+        cls.guest = CustomUser.objects.create_user(username="guest", password="x", role="guest")
+        LinkTenantLandlord.objects.create(
+            landlord=cls.landlord, tenant=cls.tenant, property_name="Flat 0",
+            rent=7000, meter_rate=10, start_date=BILLING_START,
+        )
+
+        cls.anonymous = Client()
+        cls.landlord_client = Client()
+        cls.landlord_client.force_login(cls.landlord)
+        cls.tenant_client = Client()
+        cls.tenant_client.force_login(cls.tenant)
+        cls.guest_client = Client()
+        cls.guest_client.force_login(cls.guest)
+
+        cls.results = {}  # route -> [(scale, metrics)]
+        for scale in SCALES:
+            seed_dataset(cls.landlord, cls.tenant, scale)
+            for name, (client, url) in cls.routes().items():
+                cls.results.setdefault(name, []).append((scale, cls.measure(client, url)))
+
+    @classmethod
+    def tearDownClass(cls):
+        report = os.environ.get("BENCH_REPORT")
+        if report and getattr(cls, "results", None):
+            with open(report, "w") as f:
+                f.write(f"{'route':<22}{'scale':>8}{'queries':>9}{'p50 ms':>10}{'p95 ms':>10}{'peak KB':>10}\n")
+                for name, rows in cls.results.items():
+                    for scale, m in rows:
+                        f.write(f"{name:<22}{scale:>8}{m['queries']:>9}{m['p50_ms']:>10.1f}"
+                                f"{m['p95_ms']:>10.1f}{m['peak_kb']:>10.0f}\n")
+        super().tearDownClass()
+
+    def assertConstantQueries(self, route):
+        counts = {scale: m["queries"] for scale, m in self.results[route]}
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f"{route} query count grows with data size: {counts}"
+        )
+
+    def test_home(self):
+        self.assertConstantQueries("home")
+
+    def test_login(self):
+        self.assertConstantQueries("login")
+
+    def test_signup(self):
+        self.assertConstantQueries("signup")
+
+    def test_dashboard(self):
+        self.assertConstantQueries("dashboard")
+
+    def test_landlord_dashboard(self):
+        self.assertConstantQueries("landlord_dashboard")
+
+    def test_tenant_dashboard(self):
+        self.assertConstantQueries("tenant_dashboard")
+
+    def test_guest_dashboard(self):
+        self.assertConstantQueries("guest_dashboard")
+
+    def test_manage_tenants(self):
+        self.assertConstantQueries("manage_tenants")
+
+    def test_update_tenant(self):
+        self.assertConstantQueries("update_tenant")
+
+    def test_tenant_invites(self):
+        self.assertConstantQueries("tenant_invites")
+
+    def test_view_bill(self):
+        self.assertConstantQueries("view_bill")
+
+    def test_bill_detail(self):
+        self.assertConstantQueries("bill_detail")
+
+    def test_chat(self):
+        self.assertConstantQueries("chat")
+
+    def test_fetch_messages(self):
+        self.assertConstantQueries("fetch_messages")
+
+    def test_wait_for_messages(self):
+        self.assertConstantQueries("wait_for_messages")
+
+    def test_documents_dashboard(self):
+        self.assertConstantQueries("documents_dashboard")
+
+    def test_tenant_documents(self):
+        self.assertConstantQueries("tenant_documents")
+
+    def test_all_bills(self):
+        self.assertConstantQueries("all_bills")
+
+    def test_all_bills_json(self):
+        self.assertConstantQueries("all_bills_json")
+
+    def test_tenant_all_bills(self):
+        self.assertConstantQueries("tenant_all_bills")
+
+    def test_profile(self):
+        self.assertConstantQueries("profile")
+
+    def test_password_change(self):
+        self.assertConstantQueries("password_change")
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class LedgerTests(TestCase):
+    """Bill edits and deletes carried into later bills and the TenancyBalance snapshot."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("ledger_landlord", password="pw", role="landlord",
+                                                      phone_number="6000000001")
+        cls.tenant = OfflineTenants.objects.create(
+            landlord=cls.landlord, name="Ledger", phone_number="6000000002", property_name="Unit",
+            rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+        generate_bills(today=date(2024, 3, 1))  # January, February, March
+
+    def bills(self):
+        return list(Billing.objects.filter(offline_tenant=self.tenant).order_by("start_date"))
+
+    def balance(self):
+        return TenancyBalance.objects.get(offline_tenant=self.tenant)
+
+    def test_unchanged_edit_stops_recompute_at_next_bill(self):
+        january = self.bills()[0]
+        january.misc_note = "Checked"
+        january.save()
+        # One read of the later bills, which stops at the first (already correct) one
+        with self.assertNumQueries(1):
+            self.assertEqual(recompute_following(january), 0)
+
+    def test_changed_edit_updates_later_bills_and_balance(self):
+        january, february, march = self.bills()
+        january.current_meter_reading = 50
+        january.amount_paid = 200
+        january.save()
+        self.assertEqual(recompute_following(january), 2)
+
+        january, february, march = self.bills()
+        self.assertEqual(february.previous_meter_reading, 50)
+        self.assertEqual(february.current_meter_reading, 50)  # raised to avoid negative consumption
+        self.assertEqual(february.previous_due_amount, january.remaining_due_amount)
+        self.assertEqual(march.previous_meter_reading, 50)
+        self.assertEqual(march.previous_due_amount, february.remaining_due_amount)
+        self.assertEqual(march.remaining_due_amount, 1000 + 500 + 1000 + 1000 - 200)
+
+        balance = self.balance()
+        self.assertEqual(balance.latest_bill_id, march.id)
+        self.assertEqual(balance.current_due, march.remaining_due_amount)
+        self.assertEqual(balance.last_meter_reading, 50)
+
+    def test_deleting_latest_bill_refreshes_balance(self):
+        january, february, march = self.bills()
+        march.delete()
+        balance = self.balance()
+        self.assertEqual(balance.latest_bill_id, february.id)
+        self.assertEqual(balance.current_due, february.remaining_due_amount)
+        self.assertEqual(balance.last_period_end, february.end_date)
+
+    def test_deleting_older_bill_keeps_balance(self):
+        january, february, march = self.bills()
+        january.delete()
+        self.assertEqual(self.balance().latest_bill_id, march.id)
+
+    def test_deleting_every_bill_drops_balance(self):
+        Billing.objects.filter(offline_tenant=self.tenant).delete()
+        self.assertFalse(TenancyBalance.objects.filter(offline_tenant=self.tenant).exists())
+
+
+class LinkRequestRespondTests(TestCase):
+    """LinkRequest.respond moves only pending invites and links each landlord once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("invite_landlord", password="pw", role="landlord",
+                                                      phone_number="6100000001")
+        cls.tenant = CustomUser.objects.create_user("invite_tenant", password="pw", role="tenant",
+                                                    phone_number="6100000002")
+
+    def invite(self, status="pending"):
+        return LinkRequest.objects.create(
+            sender=self.landlord, receiver=self.tenant, status=status, property_name="Flat 1", rent=6000,
+        )
+
+    def test_accepting_twice_links_once(self):
+        invite = self.invite()
+        self.assertEqual(LinkRequest.respond(self.tenant, [invite.id], accept=True), [invite])
+        self.assertEqual(LinkRequest.respond(self.tenant, [invite.id], accept=True), [])
+
+        links = LinkTenantLandlord.objects.filter(landlord=self.landlord, tenant=self.tenant)
+        self.assertEqual(links.count(), 1)
+        self.assertEqual(links.get().property_name, "Flat 1")
+        invite.refresh_from_db()
+        self.assertEqual(invite.status, "accepted")
+
+    def test_declined_invite_cannot_be_accepted(self):
+        invite = self.invite()
+        LinkRequest.respond(self.tenant, [invite.id], accept=False)
+        self.assertEqual(LinkRequest.respond(self.tenant, [invite.id], accept=True), [])
+
+        invite.refresh_from_db()
+        self.assertEqual(invite.status, "rejected")
+        self.assertFalse(LinkTenantLandlord.objects.filter(landlord=self.landlord, tenant=self.tenant).exists())
+
+    def test_other_receivers_invites_are_untouched(self):
+        other = CustomUser.objects.create_user("invite_other", password="pw", role="tenant",
+                                               phone_number="6100000003")
+        invite = self.invite()
+        self.assertEqual(LinkRequest.respond(other, [invite.id], accept=True), [])
+        invite.refresh_from_db()
+        self.assertEqual(invite.status, "pending")
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class DocumentDownloadTests(TestCase):
+    """download_document's permission check, conditional GETs and byte ranges."""
+
+    content = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("docs_landlord", password="pw", role="landlord",
+                                                      phone_number="6200000001")
+        cls.other_landlord = CustomUser.objects.create_user("docs_other", password="pw", role="landlord",
+                                                            phone_number="6200000002")
+        tenant = OfflineTenants.objects.create(
+            landlord=cls.landlord, name="Docs", phone_number="6200000003", property_name="Unit",
+            rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+        cls.doc = TenantDocument(tenant_type="offline", offline_tenant=tenant, document_name="Lease.pdf")
+        cls.doc.file.save("lease.pdf", ContentFile(cls.content), save=True)
+        cls.url = reverse("download_document", args=[cls.doc.id])
+
+    def setUp(self):
+        self.client.force_login(self.landlord)
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_byte_range(self):
+        response = self.client.get(self.url, headers={"Range": "bytes=100-199"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 100-199/{len(self.content)}")
+        self.assertEqual(self.body(response), self.content[100:200])
+
+    def test_suffix_range(self):
+        size = len(self.content)
+        response = self.client.get(self.url, headers={"Range": "bytes=-10"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes {size - 10}-{size - 1}/{size}")
+        self.assertEqual(self.body(response), self.content[-10:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, headers={"Range": f"bytes={len(self.content)}-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.content)}")
+
+    def test_if_none_match(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_stale_if_range_sends_whole_file(self):
+        response = self.client.get(self.url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_stale_if_range_ignores_unsatisfiable_range(self):
+        # The range was computed against an older, longer copy: send the new file whole
+        headers = {"Range": f"bytes={len(self.content) + 100}-", "If-Range": '"stale"'}
+        response = self.client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_missing_file_is_404(self):
+        doc = TenantDocument.objects.create(
+            tenant_type="offline", offline_tenant=self.doc.offline_tenant, document_name="Gone.pdf",
+            file="blobs/00/missing.pdf",
+        )
+        response = self.client.get(reverse("download_document", args=[doc.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_other_landlord_is_forbidden(self):
+        self.client.force_login(self.other_landlord)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_storage_url_is_not_public(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.doc.file.url).status_code, 404)
+
+
+@override_settings(SQL_PROFILING=True, SQL_PROFILING_SLOW_MS=60_000, SQL_PROFILING_MAX_QUERIES=1000)
+class QueryProfilingMiddlewareTests(TestCase):
+    """The Server-Timing query count, for sync and async handler chains."""
+
+    def test_sync_chain(self):
+        def view(request):
+            CustomUser.objects.count()
+            ChatMessage.objects.count()
+            return HttpResponse()
+
+        response = QueryProfilingMiddleware(view)(RequestFactory().get("/"))
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+
+    async def test_async_chain(self):
+        async def view(request):
+            await CustomUser.objects.acount()
+            await ChatMessage.objects.acount()
+            return HttpResponse()
+
+        middleware = QueryProfilingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get("/"))
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class BillingJobTests(TestCase):
+    """The billing lease, the job's run history and catching up on missed periods."""
+
+    @classmethod
+    def setUpTestData(cls):
+        landlord = CustomUser.objects.create_user("job_landlord", password="pw", role="landlord",
+                                                  phone_number="6300000001")
+        cls.tenant = OfflineTenants.objects.create(
+            landlord=landlord, name="Job", phone_number="6300000002", property_name="Unit",
+            rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lease_is_exclusive_until_released(self):
+        self.assertTrue(acquire_lease(BILLING_JOB, "a"))
+        self.assertFalse(acquire_lease(BILLING_JOB, "b"))
+        release_lease(BILLING_JOB, "b")  # not the holder: no effect
+        self.assertFalse(acquire_lease(BILLING_JOB, "b"))
+        release_lease(BILLING_JOB, "a")
+        self.assertTrue(acquire_lease(BILLING_JOB, "b"))
+
+    def test_expired_lease_is_taken_over_and_cannot_be_renewed(self):
+        self.assertTrue(acquire_lease(BILLING_JOB, "a"))
+        ScheduledJob.objects.filter(name=BILLING_JOB).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_lease(BILLING_JOB, "b"))
+        self.assertFalse(renew_lease(BILLING_JOB, "a"))
+        self.assertTrue(renew_lease(BILLING_JOB, "b"))
+
+    def test_lost_lease_rolls_the_run_back(self):
+        def heartbeat():
+            raise LeaseLost("taken over")
+
+        with self.assertRaises(LeaseLost):
+            generate_bills(today=date(2024, 3, 1), heartbeat=heartbeat)
+        self.assertFalse(Billing.objects.exists())
+
+    def test_run_catches_up_missed_periods_and_records_history(self):
+        result = run_billing_job(today=date(2024, 4, 15))
+        self.assertEqual(result["bills_created"], 4)  # January .. April
+        self.assertEqual(billing_watermark(today=date(2024, 4, 15)), date(2024, 4, 15))
+
+        run = ScheduledJobRun.objects.get()
+        self.assertEqual(run.rows_created, 4)
+        self.assertIsNotNone(run.finished_at)
+        self.assertIsNone(ScheduledJob.objects.get(name=BILLING_JOB).lease_owner)
+
+    def test_run_is_skipped_while_another_holds_the_lease(self):
+        acquire_lease(BILLING_JOB, "elsewhere")
+        self.assertIsNone(run_billing_job(today=date(2024, 4, 15)))
+        self.assertFalse(Billing.objects.exists())
+        self.assertFalse(ScheduledJobRun.objects.exists())
+
+    def test_skipped_conflicts_are_not_counted_as_created(self):
+        run_billing_job(today=date(2024, 2, 1))
+        # Pretend the latest bills were missed, so both periods are generated again
+        with patch("accounts.scheduler.latest_bills_by_tenancy", return_value={}):
+            result = run_billing_job(today=date(2024, 2, 1))
+        self.assertEqual(result["periods_due"], 2)
+        self.assertEqual(result["bills_created"], 0)
+        self.assertEqual(ScheduledJobRun.objects.latest("id").rows_created, 0)
+        self.assertEqual(Billing.objects.count(), 2)
+
+    def test_run_bills_command_goes_through_the_job(self):
+        out = StringIO()
+        call_command("run_bills", stdout=out)
+        created = Billing.objects.count()
+        self.assertIn(f"{created} bills", out.getvalue())
+        self.assertEqual(ScheduledJobRun.objects.get().rows_created, created)
+        self.assertEqual(billing_watermark(), date.today())
+
+        acquire_lease(BILLING_JOB, "elsewhere")
+        with self.assertRaises(CommandError):
+            call_command("run_bills", stdout=StringIO())
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class TenantRosterTests(TestCase):
+    """The manage_tenants UNION roster and its dues, which must match TenancyBalance."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("roster_landlord", password="pw", role="landlord",
+                                                      phone_number="6400000001")
+        cls.billed = OfflineTenants.objects.create(
+            landlord=cls.landlord, name="Billed", phone_number="6400000002", property_name="A",
+            rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+        user = CustomUser.objects.create_user("zed", password="pw", role="tenant", phone_number="6400000003")
+        cls.link = LinkTenantLandlord.objects.create(
+            landlord=cls.landlord, tenant=user, property_name="B", rent=2000, meter_rate=10,
+            start_date=date(2024, 1, 1),
+        )
+        generate_bills(today=date(2024, 2, 1))
+
+        # No bills yet: the due falls back to the tenancy's own opening due
+        cls.unbilled = OfflineTenants.objects.create(
+            landlord=cls.landlord, name="Credit", phone_number="6400000004", property_name="C",
+            rent=500, due_amount=-300, meter_rate=10, starting_meter_reading=7, start_date=date(2030, 1, 1),
+        )
+        invitee = CustomUser.objects.create_user("amy", password="pw", role="tenant", phone_number="6400000005")
+        LinkRequest.objects.create(sender=cls.landlord, receiver=invitee, status="pending",
+                                   property_name="D", rent=900, due_amount=50)
+
+    def test_one_query_with_every_kind_in_order(self):
+        with self.assertNumQueries(1):
+            roster = tenant_roster(self.landlord)
+        self.assertEqual([row["name"] for row in roster], ["amy", "Billed", "Credit", "zed"])
+        self.assertEqual([row["pending_invite"] for row in roster], [True, False, False, False])
+        self.assertEqual([row["is_online"] for row in roster], [True, False, False, True])
+
+    def test_dues_match_tenancy_balance(self):
+        dues = {row["name"]: (row["due_amount"], row["latest_meter"]) for row in tenant_roster(self.landlord)}
+        for name, tenancy in (("Billed", {"offline_tenant": self.billed}), ("zed", {"online_tenant": self.link})):
+            balance = TenancyBalance.objects.get(**tenancy)
+            self.assertEqual(dues[name], (balance.current_due, balance.last_meter_reading))
+        self.assertEqual(dues["Credit"], (-300, 7))
+        self.assertEqual(dues["amy"][0], 50)
+
+    def test_due_filter_and_search(self):
+        self.assertEqual([r["name"] for r in tenant_roster(self.landlord, due_filter="extra")], ["Credit"])
+        self.assertEqual([r["name"] for r in tenant_roster(self.landlord, due_filter="pending")],
+                         ["amy", "Billed", "zed"])
+        self.assertEqual([r["name"] for r in tenant_roster(self.landlord, query="6400000003")], ["zed"])
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class BillHistoryPagingTests(TestCase):
+    """all_bills_json's (start_date, id) keyset pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("paging_landlord", password="pw", role="landlord",
+                                                      phone_number="6500000001")
+        for i in range(2):  # Same periods, so pages must break ties on id
+            OfflineTenants.objects.create(
+                landlord=cls.landlord, name=f"Paging {i}", phone_number=f"65000001{i:02d}", property_name="A",
+                rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+            )
+        generate_bills(today=date(2024, 5, 1))  # 5 periods x 2 tenancies
+        cls.url = reverse("all_bills_json")
+
+    def setUp(self):
+        self.client.force_login(self.landlord)
+
+    def test_pages_cover_every_bill_once_in_order(self):
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 3, **({"after": cursor} if cursor else {})}
+            data = self.client.get(self.url, params).json()
+            pages.append(data)
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual([len(page["bills"]) for page in pages], [3, 3, 3, 1])
+        ids = [bill["id"] for page in pages for bill in page["bills"]]
+        expected = list(Billing.objects.order_by("-start_date", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_exact_last_page_has_no_cursor(self):
+        data = self.client.get(self.url, {"limit": 10}).json()
+        self.assertEqual(len(data["bills"]), 10)
+        self.assertIsNone(data["next_cursor"])
+
+    def test_totals_only_on_first_page(self):
+        first = self.client.get(self.url, {"limit": 4}).json()
+        self.assertEqual(first["totals"]["count"], 10)
+        self.assertEqual(first["totals"]["rent"], 10 * 1000)
+        second = self.client.get(self.url, {"limit": 4, "after": first["next_cursor"]}).json()
+        self.assertNotIn("totals", second)
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ("garbage", "2024-13-01_5", "2024-01-01_x"):
+            self.assertEqual(self.client.get(self.url, {"after": cursor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("all_bills"), {"after": "garbage"}).status_code, 400)
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class ChatPagingTests(TestCase):
+    """fetch_messages' since/before id cursors over a two-way conversation."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("chat_landlord", password="pw", role="landlord",
+                                                      phone_number="6600000001")
+        cls.tenant = CustomUser.objects.create_user("chat_tenant", password="pw", role="tenant",
+                                                    phone_number="6600000002")
+        stranger = CustomUser.objects.create_user("chat_stranger", password="pw", role="tenant",
+                                                  phone_number="6600000003")
+        cls.ids = []
+        for i in range(7):
+            sender, receiver = (cls.landlord, cls.tenant) if i % 2 else (cls.tenant, cls.landlord)
+            cls.ids.append(ChatMessage.objects.create(sender=sender, receiver=receiver, message=f"m{i}").id)
+            ChatMessage.objects.create(sender=stranger, receiver=cls.landlord, message="elsewhere")
+        cls.url = reverse("fetch_messages", args=[cls.tenant.id])
+
+    def setUp(self):
+        self.client.force_login(self.landlord)
+
+    def page(self, **params):
+        response = self.client.get(self.url, {"limit": 3, **params})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [m["id"] for m in data["messages"]], data["has_more"]
+
+    def test_latest_page_then_history(self):
+        self.assertEqual(self.page(), (self.ids[4:], True))
+        self.assertEqual(self.page(before=self.ids[4]), (self.ids[1:4], True))
+        self.assertEqual(self.page(before=self.ids[1]), (self.ids[:1], False))
+
+    def test_since_returns_newer_messages_oldest_first(self):
+        self.assertEqual(self.page(since=self.ids[0]), (self.ids[1:4], True))
+        self.assertEqual(self.page(since=self.ids[3]), (self.ids[4:], False))
+        self.assertEqual(self.page(since=self.ids[-1]), ([], False))
+
+    def test_both_directions_are_included(self):
+        data = self.client.get(self.url, {"limit": 50}).json()
+        senders = {m["sender"] for m in data["messages"]}
+        self.assertEqual(senders, {"chat_landlord", "chat_tenant"})
+        self.assertEqual(len(data["messages"]), 7)
+
+    def test_malformed_cursor_is_rejected(self):
+        for params in ({"since": "abc"}, {"before": "-1"}, {"since": "1.5"}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        wait_url = reverse("wait_for_messages", args=[self.tenant.id])
+        self.assertEqual(self.client.get(wait_url, {"since": "abc"}).status_code, 400)
+
+    def test_long_poll_returns_pending_messages_at_once(self):
+        wait_url = reverse("wait_for_messages", args=[self.tenant.id])
+        data = self.client.get(wait_url, {"since": self.ids[4]}).json()
+        self.assertEqual([m["id"] for m in data["messages"]], self.ids[5:])
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class AsgiChainTests(TestCase):
+    """Under ASGI every middleware must run async, or long-polls hold a thread each."""
+
+    @override_settings(DEBUG=True)  # Django only logs handler adaptation with DEBUG on
+    def test_asgi_handler_builds_an_async_chain(self):
+        with self.assertLogs("django.request", "DEBUG") as logs:
+            handler = ASGIHandler()
+            logging.getLogger("django.request").debug("chain built")
+        adapted = [line for line in logs.output if "adapted" in line]
+        self.assertEqual(adapted, [])
+        self.assertTrue(iscoroutinefunction(handler._middleware_chain))
+        for path in settings.MIDDLEWARE:
+            middleware = import_string(path)
+            self.assertTrue(getattr(middleware, "async_capable", False), f"{path} is sync-only")
+
+    async def test_long_poll_through_the_async_chain(self):
+        landlord = await CustomUser.objects.acreate(username="asgi_landlord", role="landlord",
+                                                    phone_number="6700000001")
+        tenant = await CustomUser.objects.acreate(username="asgi_tenant", role="tenant",
+                                                  phone_number="6700000002")
+        message = await ChatMessage.objects.acreate(sender=tenant, receiver=landlord, message="hi")
+        await self.async_client.aforce_login(landlord)
+        response = await self.async_client.get(reverse("wait_for_messages", args=[tenant.id]), {"since": 0})
+        self.assertEqual([m["id"] for m in response.json()["messages"]], [message.id])
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class ExportCommandTests(TestCase):
+    """The streaming export: full sections, formats, delta mode, tombstones and checkpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("export_landlord", password="pw", role="landlord",
+                                                      phone_number="6800000001")
+        tenant = CustomUser.objects.create_user("export_tenant", password="pw", role="tenant",
+                                                phone_number="6800000002")
+        cls.offline = OfflineTenants.objects.create(
+            landlord=cls.landlord, name="Export", phone_number="6800000003", property_name="A",
+            rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+        LinkRequest.objects.create(sender=cls.landlord, receiver=tenant, status="pending", rent=500)
+        ChatMessage.objects.create(sender=tenant, receiver=cls.landlord, message="hello")
+        generate_bills(today=date(2024, 3, 1))
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    def export(self, *args, name="export.json"):
+        path = os.path.join(self.dir, name)
+        call_command("export", "--output", path, "--chunk-size", "2", *args, stdout=StringIO())
+        return path
+
+    def ndjson(self, *args):
+        with open(self.export("--format", "ndjson", *args, name="export.jsonl")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_full_export_has_every_section(self):
+        with open(self.export()) as f:
+            data = json.load(f)
+        self.assertEqual(set(data), {name for name, _ in SECTIONS})
+        self.assertIn("link_requests", data)
+        self.assertEqual(len(data["bills"]), 3)
+        self.assertEqual([m["message"] for m in data["chat_messages"]], ["hello"])
+        self.assertEqual(data["link_requests"][0]["status"], "pending")
+
+    def test_gzip_ndjson(self):
+        path = self.export("--format", "ndjson", "--gzip", name="export.jsonl.gz")
+        with gzip.open(path, "rt") as f:
+            types = Counter(json.loads(line)["type"] for line in f)
+        self.assertEqual(types["bills"], 3)
+        self.assertEqual(types["chat_messages"], 1)
+
+    def test_delta_exports_changes_and_tombstones(self):
+        since = timezone.now() - timedelta(hours=1)
+        for model in (Billing, OfflineTenants, LinkRequest, ChatMessage):
+            model.objects.update(updated_at=since - timedelta(days=1))
+        january, february, march = Billing.objects.order_by("start_date")
+        Billing.objects.filter(id=february.id).update(updated_at=timezone.now())
+        march_id = march.id
+        march.delete()
+
+        records = self.ndjson("--since", since.isoformat())
+        self.assertEqual([(r["type"], r.get("id", r.get("object_id"))) for r in records],
+                         [("bills", february.id), ("deleted", march_id)])
+        self.assertEqual(records[1]["model"], "billing")
+
+    def test_checkpoint_overlaps_rows_committed_after_the_export_started(self):
+        checkpoint = os.path.join(self.dir, "checkpoint.json")
+        self.ndjson("--checkpoint", checkpoint)  # No checkpoint yet: a full delta
+        with open(checkpoint) as f:
+            stored = parse_datetime(json.load(f)["since"])
+        self.assertLessEqual(stored, timezone.now() - CHECKPOINT_OVERLAP)
+
+        for model in (Billing, OfflineTenants, LinkRequest, ChatMessage):
+            model.objects.update(updated_at=stored - timedelta(days=1))
+        # Saved a moment before that export started, but committed after it
+        late = Billing.objects.order_by("start_date").first()
+        Billing.objects.filter(id=late.id).update(updated_at=stored + CHECKPOINT_OVERLAP - timedelta(seconds=1))
+
+        records = self.ndjson("--checkpoint", checkpoint)
+        self.assertEqual([(r["type"], r["id"]) for r in records], [("bills", late.id)])
+
+
+class BillCleanupMigrationTests(TransactionTestCase):
+    """0034's clean-up of duplicate and unassigned bills before the period constraints."""
+
+    before = [("accounts", "0033_tenancybalance")]
+    after = [("accounts", "0034_billing_indexes_and_constraints")]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.apps = self.executor.loader.project_state(self.before).apps
+        self.addCleanup(self.migrate_to_latest)
+
+        CustomUser = self.apps.get_model("accounts", "CustomUser")
+        OfflineTenants = self.apps.get_model("accounts", "OfflineTenants")
+        landlord = CustomUser.objects.create(username="migration_landlord", role="landlord",
+                                             phone_number="6900000001")
+        self.tenant = OfflineTenants.objects.create(
+            landlord=landlord, name="Migration", phone_number="6900000002", property_name="A",
+            rent=1000, due_amount=0, meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def bill(self, start, end, **fields):
+        Billing = self.apps.get_model("accounts", "Billing")
+        fields = {"offline_tenant": self.tenant, "rent": 1000, "previous_meter_reading": 0,
+                  "current_meter_reading": 0, "remaining_due_amount": 1000, **fields}
+        return Billing.objects.create(start_date=start, end_date=end, **fields)
+
+    def build_balances(self):
+        # What 0033 did: snapshot each tenancy's latest bill, duplicates included
+        TenancyBalance = self.apps.get_model("accounts", "TenancyBalance")
+        Billing = self.apps.get_model("accounts", "Billing")
+        latest = Billing.objects.order_by("-end_date", "-id").first()
+        TenancyBalance.objects.create(offline_tenant=self.tenant, latest_bill_id=latest.id,
+                                      current_due=latest.remaining_due_amount,
+                                      last_period_end=latest.end_date)
+        return latest
+
+    def test_identical_duplicates_are_merged_with_tombstones_and_balances(self):
+        january = self.bill(date(2024, 1, 1), date(2024, 1, 31))
+        february = self.bill(date(2024, 2, 1), date(2024, 2, 29), remaining_due_amount=2000)
+        copy = self.bill(date(2024, 2, 1), date(2024, 2, 29), remaining_due_amount=2000)
+        self.assertEqual(self.build_balances().id, copy.id)
+        Billing = self.apps.get_model("accounts", "Billing")
+        Billing.objects.filter(id=february.id).update(updated_at=timezone.now() + timedelta(minutes=1))
+        unassigned = self.bill(date(2024, 1, 1), date(2024, 1, 31), offline_tenant=None)
+
+        MigrationExecutor(connection).migrate(self.after)
+
+        apps = MigrationExecutor(connection).loader.project_state(self.after).apps
+        self.assertEqual(
+            list(apps.get_model("accounts", "Billing").objects.order_by("id").values_list("id", flat=True)),
+            [january.id, february.id],
+        )
+        tombstones = apps.get_model("accounts", "DeletedRecord").objects.values_list("model_name", "object_id")
+        self.assertEqual(sorted(tombstones), sorted([("billing", copy.id), ("billing", unassigned.id)]))
+        balance = apps.get_model("accounts", "TenancyBalance").objects.get(offline_tenant_id=self.tenant.id)
+        self.assertEqual((balance.latest_bill_id, balance.current_due), (february.id, 2000))
+
+    def test_duplicates_with_different_amounts_stop_the_migration(self):
+        first = self.bill(date(2024, 1, 1), date(2024, 1, 31), amount_paid=500)
+        second = self.bill(date(2024, 1, 1), date(2024, 1, 31))
+        paid_orphan = self.bill(date(2024, 1, 1), date(2024, 1, 31), offline_tenant=None, amount_paid=300)
+
+        with self.assertRaises(RuntimeError) as raised:
+            MigrationExecutor(connection).migrate(self.after)
+        message = str(raised.exception)
+        self.assertIn(f"#{first.id}", message)
+        self.assertIn(f"#{second.id}", message)
+        self.assertIn(f"unassigned bill #{paid_orphan.id}", message)
+
+        # Nothing was deleted; the rows are left for someone to resolve
+        self.assertEqual(self.apps.get_model("accounts", "Billing").objects.count(), 3)
+        self.apps.get_model("accounts", "Billing").objects.filter(id__in=[second.id, paid_orphan.id]).delete()
+
+
+class SeedLoadTests(TestCase):
+    """A small seed_load run produces consistent bill chains and balances."""
+
+    def test_small_seed_verifies(self):
+        call_command(
+            "seed_load", "--landlords", "2", "--offline", "3", "--online", "2", "--invites", "1",
+            "--months", "4", "--messages", "3", "--seed", "7", "--batch-size", "5", stdout=StringIO(),
+        )
+        self.assertEqual(Billing.objects.count(), 2 * (3 + 2) * 4)
+        self.assertEqual(TenancyBalance.objects.count(), 2 * (3 + 2))
+
+        # Each bill's stored totals follow Billing.recalculate and chain from the one before
+        previous = {}
+        for bill in Billing.objects.order_by("offline_tenant_id", "online_tenant_id", "start_date"):
+            stored = (bill.total_amount, bill.remaining_due_amount, bill.status)
+            bill.recalculate()
+            self.assertEqual(stored, (bill.total_amount, bill.remaining_due_amount, bill.status))
+            tenancy = (bill.offline_tenant_id, bill.online_tenant_id)
+            if tenancy in previous:
+                self.assertEqual(bill.previous_due_amount, previous[tenancy].remaining_due_amount)
+                self.assertEqual(bill.previous_meter_reading, previous[tenancy].current_meter_reading)
+            previous[tenancy] = bill
+
+        out = StringIO()
+        call_command("rebuild_balances", "--verify", stdout=out)
+        self.assertIn("match the bills", out.getvalue())
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class LoginTests(TestCase):
+    """UsernameOrPhoneBackend lookups and the database-backed failure throttle."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # One account's username is another account's phone number
+        cls.by_name = CustomUser.objects.create_user("9876543210", password="name-pw", role="tenant")
+        cls.by_phone = CustomUser.objects.create_user(
+            "phoneuser", password="phone-pw", role="tenant", phone_number="9876543210",
+        )
+        cls.landlord = CustomUser.objects.create_user(
+            "login_landlord", password="pw", role="landlord", phone_number="9123456780",
+        )
+
+    def test_username_beats_phone_number(self):
+        self.assertEqual(authenticate(None, username="9876543210", password="name-pw"), self.by_name)
+        self.assertIsNone(authenticate(None, username="9876543210", password="phone-pw"))
+
+    def test_phone_number_logs_in(self):
+        self.assertEqual(authenticate(None, username="9123456780", password="pw"), self.landlord)
+        self.assertEqual(authenticate(None, username="login_landlord", password="pw"), self.landlord)
+
+    def test_unknown_account_still_hashes(self):
+        with patch.object(CustomUser, "set_password") as set_password:
+            self.assertIsNone(authenticate(None, username="nobody", password="secret"))
+        set_password.assert_called_once_with("secret")
+
+    def login(self, username, password, ip="10.0.0.1"):
+        return self.client.post(
+            reverse("login"), {"username": username, "password": password}, REMOTE_ADDR=ip,
+        )
+
+    def test_account_lockout_and_reset(self):
+        for _ in range(LOGIN_FAILURES_PER_ACCOUNT):
+            self.assertContains(self.login("login_landlord", "wrong"), "Invalid login credentials.")
+
+        # Locked out even with the right password, and from another address
+        response = self.login("Login_Landlord ", "pw", ip="10.0.0.2")
+        self.assertContains(response, "Too many failed login attempts.")
+        self.assertNotIn("_auth_user_id", self.client.session)
+
+        # Once the window has passed the account gets in, which clears its counter
+        LoginFailure.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.login("login_landlord", "pw").status_code, 302)
+        self.assertFalse(LoginFailure.objects.filter(key="login:account:login_landlord").exists())
+
+    def test_success_keeps_ip_counter(self):
+        self.login("login_landlord", "wrong")
+        self.assertEqual(self.login("login_landlord", "pw").status_code, 302)
+        self.assertEqual(
+            list(LoginFailure.objects.values_list("key", "failures")), [("login:ip:10.0.0.1", 1)],
+        )
+
+    def test_ip_lockout(self):
+        for n in range(LOGIN_FAILURES_PER_IP):
+            self.login(f"guess{n}", "wrong")
+        self.assertContains(self.login("login_landlord", "pw"), "Too many failed login attempts.")
+        self.assertEqual(self.login("login_landlord", "pw", ip="10.0.0.9").status_code, 302)
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class TenantImportTests(TestCase):
+    """CSV imports are all-or-nothing and report every row's problems."""
+
+    HEADER = "name,username_or_phone,property_name,rent,due_amount,meter_rate,starting_meter_reading,start_date\n"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.landlord = CustomUser.objects.create_user("import_landlord", password="pw", role="landlord")
+        cls.tenant = CustomUser.objects.create_user(
+            "import_tenant", password="pw", role="tenant", phone_number="9000000001",
+        )
+        cls.invited = CustomUser.objects.create_user("import_invited", password="pw", role="tenant")
+        LinkRequest.objects.create(
+            sender=cls.landlord, receiver=cls.invited, status="pending", rent=1000, meter_rate=10,
+            start_date=date(2024, 1, 1),
+        )
+
+    def rows(self, *lines):
+        return read_csv((self.HEADER + "\n".join(lines)).encode())
+
+    def test_valid_file_creates_everything(self):
+        result = import_tenants(self.landlord, self.rows(
+            "Asha,,Room 1,5000,0,10,100,2024-01-01",
+            ",9000000001,Flat 2,8000,0,10,0,2024-01-01",
+        ))
+        self.assertTrue(result["created"])
+        self.assertEqual((result["offline"], result["invites"]), (1, 1))
+        self.assertEqual(
+            [(entry["row"], entry["kind"], entry["errors"]) for entry in result["rows"]],
+            [(2, "offline", {}), (3, "invite", {})],
+        )
+        self.assertEqual(OfflineTenants.objects.get(landlord=self.landlord).name, "Asha")
+        self.assertTrue(LinkRequest.objects.filter(sender=self.landlord, receiver=self.tenant).exists())
+
+    def test_one_bad_row_writes_nothing(self):
+        result = import_tenants(self.landlord, self.rows(
+            "Asha,,Room 1,5000,0,10,100,2024-01-01",
+            "Bina,,Room 2,lots,0,10,100,2024-01-01",
+            ",nobody,Flat 1,8000,0,10,0,2024-01-01",
+            ",import_invited,Flat 2,8000,0,10,0,2024-01-01",
+            ",import_tenant,Flat 3,8000,0,10,0,2024-01-01",
+            ",9000000001,Flat 4,8000,0,10,0,2024-01-01",
+        ))
+        self.assertFalse(result["created"])
+        errors = {entry["row"]: entry["errors"] for entry in result["rows"]}
+        self.assertEqual(errors[2], {})
+        self.assertEqual(list(errors[3]), ["rent"])
+        self.assertIn("No tenant exists", errors[4]["username_or_phone"][0])
+        self.assertIn("already pending", errors[5]["username_or_phone"][0])
+        self.assertEqual(errors[6], {})
+        self.assertIn("invited twice", errors[7]["username_or_phone"][0])
+
+        self.assertFalse(OfflineTenants.objects.filter(landlord=self.landlord).exists())
+        self.assertEqual(LinkRequest.objects.filter(sender=self.landlord).count(), 1)
+
+    def test_failed_insert_rolls_back(self):
+        rows = self.rows(
+            "Asha,,Room 1,5000,0,10,100,2024-01-01",
+            ",import_tenant,Flat 2,8000,0,10,0,2024-01-01",
+        )
+        with patch.object(LinkRequest.objects, "bulk_create", side_effect=DatabaseError("disk full")):
+            with self.assertRaises(DatabaseError):
+                import_tenants(self.landlord, rows)
+        self.assertFalse(OfflineTenants.objects.filter(landlord=self.landlord).exists())
+
+    def upload(self, line):
+        return ContentFile((self.HEADER + line).encode(), name="tenants.csv")
+
+    def test_view_reports_rows(self):
+        self.client.force_login(self.landlord)
+        bad = self.client.post(reverse("import_tenants"), {"file": self.upload("Asha,,Room 1,,0,10,100,2024-01-01")})
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(list(bad.json()["rows"][0]["errors"]), ["rent"])
+
+        good = "Asha,,Room 1,5000,0,10,100,2024-01-01"
+        dry = self.client.post(reverse("import_tenants"), {"file": self.upload(good), "dry_run": "1"})
+        self.assertEqual((dry.status_code, dry.json()["created"]), (200, False))
+        self.assertFalse(OfflineTenants.objects.filter(landlord=self.landlord).exists())
+
+        done = self.client.post(reverse("import_tenants"), {"file": self.upload(good)})
+        self.assertEqual((done.status_code, done.json()["created"]), (200, True))
+        self.assertEqual(OfflineTenants.objects.filter(landlord=self.landlord).count(), 1)
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class MeterPhotoTests(TestCase):
+    """process_meter_photo re-encodes upright without metadata, unless the photo was replaced."""
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        landlord = CustomUser.objects.create_user("photo_landlord", password="pw", role="landlord")
+        cls.tenant = OfflineTenants.objects.create(
+            landlord=landlord, name="Photo", property_name="Unit", rent=1000, due_amount=0,
+            meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+
+    def setUp(self):
+        self.bill = Billing.objects.create(
+            offline_tenant=self.tenant, start_date=date(2024, 1, 1), end_date=date(2024, 1, 31), rent=1000,
+            previous_meter_reading=0, current_meter_reading=0,
+        )
+
+    def sideways_jpeg(self, colour=(255, 0, 0)):
+        """80x40 JPEG, left half `colour`, right half blue, tagged 'rotate 90 clockwise' and with GPS."""
+        image = Image.new("RGB", (80, 40), (0, 0, 255))
+        image.paste(colour, (0, 0, 40, 40))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation
+        exif[0x8825] = {1: "N", 2: (27.0, 42.0, 0.0)}  # GPSInfo
+        out = io.BytesIO()
+        image.save(out, format="JPEG", exif=exif)
+        return out.getvalue()
+
+    def test_rotates_upright_and_strips_exif(self):
+        self.bill.meter_photo.save("meter.jpg", ContentFile(self.sideways_jpeg()), save=True)
+        original = self.bill.meter_photo.name
+
+        process_meter_photo(self.bill.id, original)
+        self.bill.refresh_from_db()
+        self.assertTrue(self.bill.meter_photo.name.endswith(".jpg"))
+        self.assertNotEqual(self.bill.meter_photo.name, original)
+
+        with Image.open(self.bill.meter_photo.path) as photo:
+            self.assertEqual(photo.format, "JPEG")
+            self.assertEqual(photo.size, (40, 80))
+            self.assertEqual(len(photo.getexif()), 0)
+            # The left (red) half is now on top
+            red, _, blue = photo.convert("RGB").getpixel((20, 10))
+            self.assertGreater(red, blue)
+        with Image.open(self.bill.meter_photo_thumbnail.path) as thumbnail:
+            self.assertEqual(len(thumbnail.getexif()), 0)
+
+        # The upload's reference was released
+        self.assertEqual(MediaBlob.objects.get(name=original).refs, 0)
+
+    def test_replaced_photo_is_left_alone(self):
+        self.bill.meter_photo.save("first.jpg", ContentFile(self.sideways_jpeg()), save=True)
+        first = self.bill.meter_photo.name
+        self.bill.meter_photo.save("second.jpg", ContentFile(self.sideways_jpeg((0, 255, 0))), save=True)
+        second = self.bill.meter_photo.name
+
+        # The worker catches up with the first upload only after it was replaced
+        process_meter_photo(self.bill.id, first)
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.meter_photo.name, second)
+        self.assertFalse(self.bill.meter_photo_thumbnail)
+        # Its outputs are released; the second upload still holds its reference
+        self.assertEqual(MediaBlob.objects.get(name=second).refs, 1)
+        self.assertEqual(
+            MediaBlob.objects.filter(refs__gt=0).exclude(name__in=[first, second]).count(), 0,
+        )
+
+
+@override_settings(BILLING_SCHEDULER_ENABLED=False)
+class ContentStorageTests(TestCase):
+    """Content-addressed dedupe, blob reference counts and gc_media."""
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        landlord = CustomUser.objects.create_user("blob_landlord", password="pw", role="landlord")
+        cls.tenant = OfflineTenants.objects.create(
+            landlord=landlord, name="Blob", property_name="Unit", rent=1000, due_amount=0,
+            meter_rate=10, starting_meter_reading=0, start_date=date(2024, 1, 1),
+        )
+
+    def document(self, content, filename="lease.pdf"):
+        doc = TenantDocument(tenant_type="offline", offline_tenant=self.tenant, document_name=filename)
+        doc.file.save(filename, ContentFile(content), save=True)
+        return doc
+
+    def age(self, name, minutes=120):
+        """Backdate a stored file past gc_media's grace window."""
+        stamp = time.time() - minutes * 60
+        os.utime(content_storage().path(name), (stamp, stamp))
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command("gc_media", *args, stdout=out)
+        return out.getvalue()
+
+    def test_same_content_is_stored_once(self):
+        first = self.document(b"lease terms")
+        second = self.document(b"lease terms", "copy.PDF")
+        other = self.document(b"other terms")
+
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith("blobs/") and first.file.name.endswith(".pdf"))
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertEqual(MediaBlob.objects.get(name=first.file.name).refs, 2)
+        self.assertEqual(MediaBlob.objects.get(name=other.file.name).refs, 1)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.file.path))), 1)
+
+    def test_delete_drops_a_reference_and_keeps_the_file(self):
+        first = self.document(b"shared")
+        second = self.document(b"shared")
+        name = first.file.name
+
+        first.file.delete(save=False)
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 1)
+        second.file.delete(save=False)
+        second.file.storage.delete(name)  # never below zero
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 0)
+        self.assertTrue(content_storage().exists(name))  # gc_media removes it later
+
+    def test_gc_respects_references_and_grace_window(self):
+        kept = self.document(b"still used")
+        orphan = self.document(b"orphan")
+        TenantDocument.objects.filter(id=orphan.id).delete()  # a raw delete: refs still say 1
+        self.age(kept.file.name)
+
+        # Too young to collect
+        self.assertIn("Deleted 0 unreferenced files", self.gc())
+        self.assertTrue(content_storage().exists(orphan.file.name))
+
+        self.age(orphan.file.name)
+        self.assertIn("Would delete 1 unreferenced files", self.gc("--dry-run"))
+        self.assertTrue(content_storage().exists(orphan.file.name))
+
+        self.assertIn("Deleted 1 unreferenced files", self.gc())
+        self.assertFalse(content_storage().exists(orphan.file.name))
+        self.assertFalse(MediaBlob.objects.filter(name=orphan.file.name).exists())
+        self.assertTrue(content_storage().exists(kept.file.name))
+        self.assertEqual(MediaBlob.objects.get(name=kept.file.name).refs, 1)
+
+    def test_gc_corrects_drifted_counts(self):
+        doc = self.document(b"drifted")
+        MediaBlob.objects.filter(name=doc.file.name).update(refs=5)
+        self.assertIn("1 reference counts corrected", self.gc())
+        self.assertEqual(MediaBlob.objects.get(name=doc.file.name).refs, 1)
+
+    def test_gc_rechecks_before_removing(self):
+        doc = self.document(b"late row")
+        name, path = doc.file.name, doc.file.path
+        self.age(name)
+        cutoff = time.time() - 60 * 60
+
+        # A row pointed at the file after the scan
+        self.assertIsNone(remove_if_unused(name, path, cutoff))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 1)
+
+        # An upload reused the blob after the scan (touching it), its row not committed yet
+        TenantDocument.objects.filter(id=doc.id).delete()
+        os.utime(path)
+        self.assertIsNone(remove_if_unused(name, path, cutoff))
+        self.assertTrue(os.path.exists(path))
+
+        self.age(name)
+        self.assertEqual(remove_if_unused(name, path, cutoff), len(b"late row"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_upload_rewrites_a_collected_blob(self):
+        doc = self.document(b"collected")
+        os.remove(doc.file.path)  # gc_media removed it between the upload's hash and its save
+        again = self.document(b"collected")
+        self.assertEqual(again.file.name, doc.file.name)
+        with again.file.open("rb") as f:
+            self.assertEqual(f.read(), b"collected")
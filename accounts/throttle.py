@@ -0,0 +1,47 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import LoginFailure
+
+# Failed attempts allowed per window, per client IP and per account identifier
+LOGIN_FAILURES_PER_IP = getattr(settings, "LOGIN_FAILURES_PER_IP", 20)
+LOGIN_FAILURES_PER_ACCOUNT = getattr(settings, "LOGIN_FAILURES_PER_ACCOUNT", 5)
+LOGIN_THROTTLE_SECONDS = getattr(settings, "LOGIN_THROTTLE_SECONDS", 15 * 60)
+
+# Counters live in the database, not the cache: the default cache is
+# per-process memory, so with several workers each one would allow the
+# full number of attempts.
+
+
+def _keys(request, identifier):
+    ip = request.META.get("REMOTE_ADDR", "") if request is not None else ""
+    return (
+        (f"login:ip:{ip}"[:255], LOGIN_FAILURES_PER_IP),
+        (f"login:account:{identifier.strip().lower()}"[:255], LOGIN_FAILURES_PER_ACCOUNT),
+    )
+
+
+def login_blocked(request, identifier):
+    """True once either the IP or the account has used up its failed attempts."""
+    limits = dict(_keys(request, identifier))
+    counts = LoginFailure.objects.filter(key__in=limits, expires_at__gt=timezone.now())
+    return any(failures >= limits[key] for key, failures in counts.values_list("key", "failures"))
+
+
+def record_login_failure(request, identifier):
+    """Count a failed attempt; each counter expires a window after its first failure."""
+    now = timezone.now()
+    with transaction.atomic():
+        LoginFailure.objects.filter(expires_at__lte=now).delete()
+        for key, _ in _keys(request, identifier):
+            if not LoginFailure.objects.filter(key=key).update(failures=F("failures") + 1):
+                LoginFailure.objects.create(
+                    key=key, failures=1, expires_at=now + timedelta(seconds=LOGIN_THROTTLE_SECONDS),
+                )
+
+
+def clear_login_failures(request, identifier):
+    """Forget the account's failures after a successful login (the IP's still count)."""
+    LoginFailure.objects.filter(key=_keys(request, identifier)[1][0]).delete()
@@ -18,17 +18,22 @@ urlpatterns = [
     path("landlord/delete-offline-tenant/<int:tenant_id>/", views.delete_offline_tenant, name="delete_offline_tenant"),
     path('delete-tenant-link/<int:link_id>/', views.delete_tenant_link, name='delete_tenant_link'),
     path('tenants/<int:tenant_id>/edit/', views.update_tenant, name='update_tenant'),
+    path('tenants/import/', views.import_tenants_view, name='import_tenants'),
     path('tenant/invites/', views.tenant_invites, name='tenant_invites'),
     path("tenants/<int:tenant_id>/note/", views.update_tenant_note, name="update_tenant_note"), 
+    path('bill/<int:bill_id>/photo/', views.meter_photo, name='meter_photo'),
     path('bill/<int:tenant_id>/<str:tenant_type>/', views.view_bill, name='view_bill'),
     path('bill/<int:bill_id>/', views.bill_detail, name='bill_detail'),
     path('chat/', views.chat_view, name='chat'),
     path('chat/messages/<int:tenant_id>/', views.fetch_messages, name='fetch_messages'),
+    path('chat/wait/<int:tenant_id>/', views.wait_for_messages, name='wait_for_messages'),
     path('chat/send/', views.send_message, name='send_message'),
     path('documents/', views.documents_dashboard, name='documents_dashboard'),
     path("documents/<int:tenant_id>/<str:tenant_type>/", views.tenant_documents, name="tenant_documents"),
     path("documents/delete/<int:doc_id>/", views.delete_document, name="delete_document"),
+    path("documents/file/<int:doc_id>/", views.download_document, name="download_document"),
     path("bills/", views.all_bills, name="all_bills"),
+    path("bills/json/", views.all_bills_json, name="all_bills_json"),
     path('register-as-tenant/', views.register_as_tenant, name='register_as_tenant'),
     path('profile/', views.profile, name='profile'),
     path("password_change/",views.CustomPasswordChangeView.as_view(), name="password_change"),
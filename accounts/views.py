@@ -1,14 +1,25 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import asyncio
+import os
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db import transaction
+from django.core.paginator import Paginator
+from django.db.models import Count, Max, Q
 from .forms import CustomUserCreationForm, CustomLogin
-from .decorators import guest_required, landlord_required, tenant_required
-from .models import CustomUser, LandlordRequest, OfflineTenants, LinkTenantLandlord, LinkRequest, Billing, ChatMessage, TenantDocument
+from .decorators import ROLE_DASHBOARDS, dashboard_for, guest_required, landlord_required, tenant_required
+from .models import CustomUser, LandlordRequest, OfflineTenants, LinkTenantLandlord, LinkRequest, Billing, ChatMessage, TenantDocument, TenancyBalance
 from .forms import OfflineTenantForm, InviteTenantForm, EditTenantForm, TenantDocumentForm, ProfileForm
+from .downloads import serve_file
+from .bill_history import bills_for, bill_totals, decode_cursor, keyset_page, page_size_from
+from .ledger import recompute_following
+from .notifier import notifier
+from .photos import MAX_UPLOAD_BYTES, schedule_meter_photo
+from .roster import tenant_roster
+from .tenant_import import ImportFileError, import_tenants, read_csv
 from datetime import date
-from django.http import JsonResponse, HttpResponseForbidden
+from django.http import Http404, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.contrib.auth import get_user_model
 from django.contrib.auth.views import PasswordChangeView
 from django.urls import reverse_lazy, reverse
@@ -24,7 +35,7 @@ def login_view(request):
         if form.is_valid():
             user = form.get_user()
             login(request, user)
-            return redirect('dashboard')
+            return redirect(dashboard_for(user))
     else:
         form = CustomLogin()
     return render(request, 'accounts/login.html', {'form': form})
@@ -44,15 +55,9 @@ def signup_view(request):
 
 @login_required
 def dashboard(request):
-    # reload fresh user role from DB
-    user = request.user.__class__.objects.get(pk=request.user.pk)
-
-    if user.role == 'guest':
-        return redirect('guest_dashboard')
-    elif user.role == 'landlord':
-        return redirect('landlord_dashboard')
-    elif user.role == 'tenant':
-        return redirect('tenant_dashboard')
+    # AuthenticationMiddleware loads the user fresh each request, so the role is current
+    if request.user.role in ROLE_DASHBOARDS:
+        return redirect(dashboard_for(request.user))
 
     return render(request, 'accounts/home.html')
 
@@ -77,7 +82,7 @@ def guest_dashboard(request):
 
 @login_required
 def landlord_request(request):
-    user = CustomUser.objects.get(pk=request.user.pk)
+    user = request.user
 
     if request.method == 'POST':
         existing_request = LandlordRequest.objects.filter(user=user).first()
@@ -167,131 +172,9 @@ def manage_tenants(request):
     query = request.GET.get("q", "")
     due_filter = request.GET.get("due_filter", "")
 
-    tenants = []
-
-    # --- Offline tenants ---
-    offline_tenants = OfflineTenants.objects.filter(landlord=landlord)
-    if query:
-        offline_tenants = offline_tenants.filter(
-            Q(name__icontains=query) | Q(phone_number__icontains=query)
-        )
-
-    for t in offline_tenants:
-        latest_bill = t.offline_bill.order_by('-created_at').first()
-
-        if latest_bill:
-            # Dynamic due calculation
-            prev_due = latest_bill.previous_due_amount or 0
-            rent = latest_bill.rent or 0
-            meter_rate = latest_bill.meter_rate or 10
-            prev_meter = latest_bill.previous_meter_reading or 0
-            curr_meter = latest_bill.current_meter_reading if latest_bill.current_meter_reading is not None else prev_meter
-            meter_amount = (curr_meter - prev_meter) * meter_rate
-            misc = latest_bill.misc_charge or 0
-            paid = latest_bill.amount_paid or 0
-
-            due_amount = prev_due + rent + meter_amount + misc - paid
-            latest_meter = curr_meter
-        else:
-            due_amount = t.due_amount or 0
-            latest_meter = t.starting_meter_reading or 0
-
-        tenants.append({
-            'id': t.id,
-            'type_label': 'Offline',
-            'status': 'active',
-            'name': t.name,
-            'phone_number': t.phone_number,
-            'property_name': t.property_name,
-            'rent': t.rent,
-            'due_amount': due_amount,
-            'latest_meter': latest_meter,
-            'start_date': t.start_date,
-            'end_date': t.end_date,
-            'note': t.note,
-            'is_online': False,
-            'tenant_obj': None,
-            'pending_invite': False,
-        })
-
-    # --- Online tenants ---
-    online_links = LinkTenantLandlord.objects.filter(landlord=landlord)
-    if query:
-        online_links = online_links.filter(
-            Q(tenant__username__icontains=query) | Q(tenant__phone_number__icontains=query)
-        )
-
-    for link in online_links:
-        latest_bill = link.online_bill.order_by('-created_at').first()
-
-        if latest_bill:
-            # Dynamic due calculation
-            prev_due = latest_bill.previous_due_amount or 0
-            rent = latest_bill.rent or 0
-            meter_rate = latest_bill.meter_rate or 10
-            prev_meter = latest_bill.previous_meter_reading or 0
-            curr_meter = latest_bill.current_meter_reading if latest_bill.current_meter_reading is not None else prev_meter
-            meter_amount = (curr_meter - prev_meter) * meter_rate
-            misc = latest_bill.misc_charge or 0
-            paid = latest_bill.amount_paid or 0
-
-            due_amount = prev_due + rent + meter_amount + misc - paid
-            latest_meter = curr_meter
-        else:
-            due_amount = link.due_amount or 0
-            latest_meter = link.starting_meter_reading or 0
-
-        tenants.append({
-            'id': link.id,
-            'type_label': 'Online',
-            'status': 'active',
-            'name': link.tenant.full_name or link.tenant.username,
-            'phone_number': link.tenant.phone_number,
-            'property_name': link.property_name,
-            'rent': link.rent,
-            'due_amount': due_amount,
-            'latest_meter': latest_meter,
-            'start_date': link.start_date,
-            'end_date': link.end_date,
-            'note': link.note,
-            'is_online': True,
-            'tenant_obj': link.tenant,
-            'pending_invite': False,
-        })
-
-    # --- Pending invites ---
-    pending_invites = LinkRequest.objects.filter(sender=landlord, status='pending')
-    if query:
-        pending_invites = pending_invites.filter(
-            Q(receiver__username__icontains=query) | Q(receiver__phone_number__icontains=query)
-        )
-    for invite in pending_invites:
-        tenants.append({
-            'id': invite.id,
-            'type_label': 'Online',
-            'status': 'pending',
-            'name': invite.receiver.full_name or invite.receiver.username,
-            'phone_number': invite.receiver.phone_number,
-            'property_name': invite.property_name,
-            'rent': invite.rent or 0,
-            'due_amount': invite.due_amount or 0,
-            'latest_meter': invite.starting_meter_reading or 0,
-            'start_date': invite.start_date,
-            'end_date': invite.end_date,
-            'note': '',
-            'is_online': True,
-            'tenant_obj': invite.receiver,
-            'pending_invite': True,
-        })
-
-    # --- Sort and filter ---
-    tenants.sort(key=lambda x: x['name'].lower() if x['name'] else "")
-    if due_filter == "pending":
-        tenants = [t for t in tenants if t['due_amount'] > 0]
-    elif due_filter == "extra":
-        tenants = [t for t in tenants if t['due_amount'] < 0]
-    elif due_filter == "clear":
-        tenants = [t for t in tenants if t['due_amount'] == 0]
+    # One UNION query: offline tenants, online tenants and pending invites,
+    # each with its live due from the latest bill, filtered and sorted in SQL
+    tenants = tenant_roster(landlord, query=query, due_filter=due_filter)
 
     context = {
         "tenants": tenants,
@@ -306,44 +189,53 @@ def manage_tenants(request):
 
 
 
+@login_required
+@landlord_required
+def import_tenants_view(request):
+    """
+    Bulk-add offline tenants and invites from an uploaded CSV (POST "file").
+
+    Answers with the per-row report as JSON: 200 when the rows were written
+    (or would be, with dry_run=1), 400 when any row failed and nothing was.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST a CSV file as 'file'."}, status=405)
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        return JsonResponse({"error": "POST a CSV file as 'file'."}, status=400)
+    try:
+        rows = read_csv(upload.read())
+    except ImportFileError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    result = import_tenants(request.user, rows, dry_run=request.POST.get("dry_run") == "1")
+    failed = any(entry["errors"] for entry in result["rows"])
+    return JsonResponse(result, status=400 if failed else 200)
+
+
 @login_required
 @tenant_required
 def tenant_invites(request):
     # Get all pending invites for this tenant
-    invites = LinkRequest.objects.filter(receiver=request.user, status='pending')
+    invites = LinkRequest.objects.filter(receiver=request.user, status='pending').select_related('sender')
 
     if request.method == "POST":
-        invite_id = request.POST.get("invite_id")
+        # One invite (invite_id) or several at once (invite_ids)
+        invite_ids = request.POST.getlist("invite_ids") or [request.POST.get("invite_id")]
+        invite_ids = [int(i) for i in invite_ids if i and i.isdigit()]
         action = request.POST.get("action")  # 'accept' or 'reject'
-        invite = get_object_or_404(LinkRequest, id=invite_id, receiver=request.user, status='pending')
-
-        if action == 'accept':
-            invite.status = 'accepted'
-            invite.save()
-
-            # Create a tenant-landlord link only when accepted
-            LinkTenantLandlord.objects.get_or_create(
-                landlord=invite.sender,
-                tenant=invite.receiver,
-                defaults={
-                    "property_name": invite.property_name or "",
-                    "rent": invite.rent or 0,
-                    "due_amount": invite.due_amount or 0,
-                    "meter_rate": invite.meter_rate or 0,
-                    "starting_meter_reading": invite.starting_meter_reading or 0,
-                    "previous_meter_reading": invite.starting_meter_reading or 0,
-                    "current_meter_reading": invite.starting_meter_reading or 0,
-                    "start_date": invite.start_date,
-                    "end_date": invite.end_date,
-                    "note": invite.note or ""
-                }
-            )
-            messages.success(request, f"Invite from {invite.sender.username} approved.")
-
-        elif action == 'reject':
-            invite.status = 'rejected'
-            invite.save()
-            messages.info(request, f"Invite from {invite.sender.username} rejected.")
+
+        if action in ('accept', 'reject') and invite_ids:
+            changed = LinkRequest.respond(request.user, invite_ids, accept=(action == 'accept'))
+            label = "Invite" if len(changed) == 1 else "Invites"
+            senders = ", ".join(invite.sender.username for invite in changed)
+            if not changed:
+                messages.warning(request, "That invite was already answered.")
+            elif action == 'accept':
+                messages.success(request, f"{label} from {senders} approved.")
+            else:
+                messages.info(request, f"{label} from {senders} rejected.")
 
         return redirect('tenant_invites')
 
@@ -449,18 +341,20 @@ def view_bill(request, tenant_id, tenant_type):
     if tenant_type == "Offline":
         tenant = get_object_or_404(OfflineTenants, id=tenant_id)
         bills_qs = tenant.offline_bill.all().order_by('-created_at')
-        last_meter = bills_qs.first().current_meter_reading if bills_qs.exists() else tenant.starting_meter_reading
-        last_due = bills_qs.first().remaining_due_amount if bills_qs.exists() else tenant.due_amount
+        balance = TenancyBalance.objects.filter(offline_tenant=tenant).first()
     elif tenant_type == "Online":
         link = get_object_or_404(LinkTenantLandlord, id=tenant_id)
         tenant = link
         bills_qs = link.online_bill.all().order_by('-created_at')
-        last_meter = bills_qs.first().current_meter_reading if bills_qs.exists() else link.starting_meter_reading
-        last_due = bills_qs.first().remaining_due_amount if bills_qs.exists() else link.due_amount
+        balance = TenancyBalance.objects.filter(online_tenant=link).first()
     else:
         messages.error(request, "Invalid tenant type.")
         return redirect("manage_tenants")
 
+    # Snapshot of the latest bill; tenancies without bills use their own opening values
+    last_meter = balance.last_meter_reading if balance else tenant.starting_meter_reading
+    last_due = balance.current_due if balance else tenant.due_amount
+
     if request.method == "POST" and "generate_bill" in request.POST:
         rent = int(request.POST.get("rent", tenant.rent))
         meter_rate = int(request.POST.get("meter_rate", getattr(tenant, "meter_rate", 10)))
@@ -512,15 +406,26 @@ def bill_detail(request, bill_id):
         note = request.POST.get("misc_note")
         paid = request.POST.get("amount_paid")
 
-        # ✅ Handle meter photo upload
+        # ✅ Handle meter photo upload (re-encoded in the background after save)
+        # Replaced files are released only once the new values are committed
+        storage = bill.meter_photo.storage
+        old_files = [f.name for f in (bill.meter_photo, bill.meter_photo_thumbnail) if f]
+        new_photo = False
         if "meter_photo" in request.FILES:
-            bill.meter_photo = request.FILES["meter_photo"]
+            upload = request.FILES["meter_photo"]
+            if upload.size > MAX_UPLOAD_BYTES:
+                messages.error(request, f"Meter photo is too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB).")
+                return redirect(f"{reverse('bill_detail', args=[bill.id])}?next={back_url}")
+            bill.meter_photo = upload
+            bill.meter_photo_thumbnail = None
+            new_photo = True
 
         # ✅ Handle remove photo checkbox
         if request.POST.get("remove_photo"):
             back_url = request.POST.get("next") or reverse("view_bill", args=[tenant.id, tenant_type])
-            bill.meter_photo.delete(save=False)  # delete file from storage
             bill.meter_photo = None
+            bill.meter_photo_thumbnail = None
+            new_photo = False
 
         if meter is not None and meter != "":
             bill.current_meter_reading = int(meter)
@@ -531,57 +436,15 @@ def bill_detail(request, bill_id):
         if paid is not None and paid != "":
             bill.amount_paid = int(paid)
 
-        # Recalculate current bill
-        bill.consumption_units = bill.current_meter_reading - bill.previous_meter_reading
-        bill.meter_bill_amount = bill.consumption_units * bill.meter_rate
-        total_amount = bill.rent + (bill.previous_due_amount or 0) + bill.meter_bill_amount + (bill.misc_charge or 0)
-        remaining_due = total_amount - (bill.amount_paid or 0)  # allow negative
-
-        bill.remaining_due_amount = remaining_due
-
-        # Status
-        if remaining_due <= 0:
-            bill.status = 'paid'
-        elif bill.amount_paid and bill.amount_paid < total_amount:
-            bill.status = 'partial'
-        else:
-            bill.status = 'unpaid'
-        bill.save()
-
-        # --- Recalculate all subsequent bills ---
-        subsequent_bills = Billing.objects.filter(
-            offline_tenant=bill.offline_tenant if bill.offline_tenant else None,
-            online_tenant=bill.online_tenant if bill.online_tenant else None,
-            start_date__gt=bill.start_date
-        ).order_by('start_date')
-
-        prev_meter = bill.current_meter_reading
-        prev_due = remaining_due
-
-        for b in subsequent_bills:
-            b.previous_meter_reading = prev_meter
-            if b.current_meter_reading is None or b.current_meter_reading < prev_meter:
-                b.current_meter_reading = prev_meter  # avoid negative consumption
-            b.previous_due_amount = prev_due
-
-            b.consumption_units = b.current_meter_reading - b.previous_meter_reading
-            b.meter_bill_amount = b.consumption_units * b.meter_rate
-
-            total_amount_b = b.rent + (b.previous_due_amount or 0) + b.meter_bill_amount + (b.misc_charge or 0)
-            remaining_due_b = total_amount_b - (b.amount_paid or 0)
-
-            b.remaining_due_amount = remaining_due_b
-
-            if remaining_due_b <= 0:
-                b.status = 'paid'
-            elif b.amount_paid and b.amount_paid < total_amount_b:
-                b.status = 'partial'
-            else:
-                b.status = 'unpaid'
-
-            b.save()
-            prev_meter = b.current_meter_reading
-            prev_due = remaining_due_b
+        # Recalculate this bill (Billing.save) and carry it through the later ones
+        with transaction.atomic():
+            bill.save()
+            recompute_following(bill)
+            if new_photo:
+                schedule_meter_photo(bill)
+            if new_photo or not bill.meter_photo:
+                for name in old_files:
+                    transaction.on_commit(lambda name=name: storage.delete(name))
 
         messages.success(request, "Bill and subsequent bills updated successfully.")
         return redirect(f"{reverse('bill_detail', args=[bill.id])}?next={back_url}")
@@ -622,35 +485,115 @@ def chat_view(request):
 
     if user.role == "landlord":
         # Only online tenants linked to this landlord
-        links = LinkTenantLandlord.objects.filter(landlord=user)
+        links = LinkTenantLandlord.objects.filter(landlord=user).select_related('tenant')
         tenants = [link.tenant for link in links]  # list of User objects
 
     elif user.role == "tenant":
         # Tenant can chat with linked landlords only
-        links = LinkTenantLandlord.objects.filter(tenant=user)
+        links = LinkTenantLandlord.objects.filter(tenant=user).select_related('landlord')
         tenants = [link.landlord for link in links]
 
     return render(request, 'accounts/chat.html', {'tenants': tenants})
 
+CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
+LONG_POLL_SECONDS = 25
+
+
+def conversation(user, other):
+    """Messages between two users, both directions."""
+    return ChatMessage.objects.filter(
+        Q(sender=user, receiver=other) | Q(sender=other, receiver=user)
+    ).select_related('sender', 'receiver')
+
+
+def serialize_message(msg):
+    return {
+        'id': msg.id,
+        'sender': msg.sender.username,
+        'receiver': msg.receiver.username,
+        'message': msg.message,
+        'timestamp': msg.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
 @login_required
 def fetch_messages(request, tenant_id):
+    """
+    Page through a conversation by message id.
+
+    ?since=<id> returns messages newer than id (oldest first), ?before=<id>
+    returns the page of history just older than id, and no cursor returns
+    the latest page. has_more tells the client whether to keep paging.
+    """
     user = request.user
     tenant = get_object_or_404(User, id=tenant_id)
 
-    messages = ChatMessage.objects.filter(
-        sender__in=[user, tenant],
-        receiver__in=[user, tenant]
-    ).order_by('timestamp')
+    try:
+        limit = max(1, min(int(request.GET.get('limit', CHAT_PAGE_SIZE)), MAX_CHAT_PAGE_SIZE))
+    except ValueError:
+        limit = CHAT_PAGE_SIZE
+    since = request.GET.get('since')
+    before = request.GET.get('before')
+    if any(cursor and not cursor.isdigit() for cursor in (since, before)):
+        return JsonResponse({'error': "'since' and 'before' must be message ids."}, status=400)
+
+    messages = conversation(user, tenant)
+    if since:
+        page = list(messages.filter(id__gt=since).order_by('timestamp', 'id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+    else:
+        if before:
+            messages = messages.filter(id__lt=before)
+        page = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit][::-1]
+
+    return JsonResponse({
+        'messages': [serialize_message(msg) for msg in page],
+        'has_more': has_more,
+    })
 
-    data = [
-        {
-            'sender': msg.sender.username,
-            'receiver': msg.receiver.username,
-            'message': msg.message,
-            'timestamp': msg.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        } for msg in messages
-    ]
-    return JsonResponse({'messages': data})
+
+@login_required
+async def wait_for_messages(request, tenant_id):
+    """
+    Long-poll: hold the request until a message newer than ?since=<id>
+    arrives in the conversation, or LONG_POLL_SECONDS pass.
+
+    Runs as an async view, so under ASGI an idle wait costs no thread.
+    Returns the same payload as fetch_messages (empty on timeout).
+    """
+    user = await request.auser()
+    tenant = await aget_object_or_404(User, id=tenant_id)
+    since = request.GET.get('since') or '0'
+    if not since.isdigit():
+        return JsonResponse({'error': "'since' must be a message id."}, status=400)
+    since = int(since)
+
+    async def new_messages():
+        qs = conversation(user, tenant).filter(id__gt=since).order_by('timestamp', 'id')
+        return [serialize_message(msg) async for msg in qs[:CHAT_PAGE_SIZE]]
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LONG_POLL_SECONDS
+    # Subscribe before the first check so a message sent in between still wakes us
+    waiter = notifier.subscribe(user.id)
+    try:
+        page = await new_messages()
+        while not page and loop.time() < deadline:
+            _, event = waiter
+            try:
+                await asyncio.wait_for(event.wait(), timeout=deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            event.clear()
+            page = await new_messages()  # woken by any of this user's conversations
+    finally:
+        notifier.unsubscribe(user.id, waiter)
+
+    return JsonResponse({'messages': page, 'has_more': len(page) == CHAT_PAGE_SIZE})
 
 
 @login_required
@@ -662,7 +605,11 @@ def send_message(request):
         receiver = get_object_or_404(User, id=receiver_id)
         msg = ChatMessage.objects.create(sender=sender, receiver=receiver, message=message)
 
+        # Wake long-polls of both participants once the message is visible
+        transaction.on_commit(lambda: (notifier.publish(receiver.id), notifier.publish(sender.id)))
+
         return JsonResponse({
+            'id': msg.id,
             'sender': msg.sender.username,
             'message': msg.message,
             'timestamp': msg.timestamp.strftime("%Y-%m-%d %H:%M:%S")
@@ -671,19 +618,27 @@ def send_message(request):
 
 @login_required
 def documents_dashboard(request):
-    # Offline tenants added by this landlord
-    offline_tenants = OfflineTenants.objects.filter(landlord=request.user)
-
-    # Online tenants linked to this landlord
-    linked_tenants = LinkTenantLandlord.objects.filter(landlord=request.user)
-    online_tenants = [link.tenant for link in linked_tenants]
+    # One query per tenant kind, each tenant carrying its document count and latest upload
+    offline_tenants = OfflineTenants.objects.filter(landlord=request.user).annotate(
+        doc_count=Count("tenantdocument"),
+        last_upload=Max("tenantdocument__uploaded_at"),
+    ).order_by("name")
+
+    online_docs = Q(tenant__tenantdocument__tenant_type="online")
+    online_links = LinkTenantLandlord.objects.filter(landlord=request.user).select_related("tenant").annotate(
+        doc_count=Count("tenant__tenantdocument", filter=online_docs),
+        last_upload=Max("tenant__tenantdocument__uploaded_at", filter=online_docs),
+    ).order_by("tenant__username")
 
     return render(request, "accounts/documents_dashboard.html", {
         'offline_tenants': offline_tenants,
-        'online_tenants': online_tenants
+        'online_links': online_links,
     })
 
 
+DOCUMENTS_PAGE_SIZE = 25
+
+
 @login_required
 @landlord_required
 def tenant_documents(request, tenant_id, tenant_type):
@@ -691,7 +646,9 @@ def tenant_documents(request, tenant_id, tenant_type):
         tenant = get_object_or_404(OfflineTenants, id=tenant_id, landlord=request.user)
         documents = TenantDocument.objects.filter(offline_tenant=tenant, tenant_type="offline")
     else:  # online
-        link = get_object_or_404(LinkTenantLandlord, tenant_id=tenant_id, landlord=request.user)
+        link = get_object_or_404(
+            LinkTenantLandlord.objects.select_related("tenant"), tenant_id=tenant_id, landlord=request.user
+        )
         tenant = link.tenant
         documents = TenantDocument.objects.filter(online_tenant=tenant, tenant_type="online")
 
@@ -709,6 +666,9 @@ def tenant_documents(request, tenant_id, tenant_type):
     else:
         form = TenantDocumentForm()
 
+    documents = Paginator(documents.order_by("-uploaded_at", "-id"), DOCUMENTS_PAGE_SIZE).get_page(
+        request.GET.get("page")
+    )
     return render(request, "accounts/tenant_documents.html", {
         "tenant": tenant,
         "documents": documents,
@@ -717,24 +677,70 @@ def tenant_documents(request, tenant_id, tenant_type):
     })
 
 
+@login_required
+def download_document(request, doc_id):
+    """Stream a document to its landlord or its online tenant, resumably and cache-validated."""
+    doc = get_object_or_404(TenantDocument.objects.select_related("offline_tenant"), id=doc_id)
+
+    if doc.tenant_type == "offline":
+        allowed = doc.offline_tenant.landlord_id == request.user.id
+    else:
+        allowed = doc.online_tenant_id == request.user.id or LinkTenantLandlord.objects.filter(
+            tenant_id=doc.online_tenant_id, landlord=request.user
+        ).exists()
+    if not allowed:
+        return HttpResponseForbidden("Not allowed")
+
+    extension = os.path.splitext(doc.file.name)[1]
+    filename = doc.document_name if doc.document_name.lower().endswith(extension) else doc.document_name + extension
+    try:
+        return serve_file(request, doc.file.storage, doc.file.name, filename,
+                          as_attachment=request.GET.get("download") == "1")
+    except FileNotFoundError:
+        raise Http404("The file for this document is missing.")
+
+
+@login_required
+def meter_photo(request, bill_id):
+    """A bill's meter photo (or ?thumbnail=1) for the bill's landlord or online tenant."""
+    bill = get_object_or_404(Billing.objects.select_related("offline_tenant", "online_tenant"), id=bill_id)
+
+    if bill.offline_tenant_id:
+        allowed = bill.offline_tenant.landlord_id == request.user.id
+    else:
+        allowed = request.user.id in (bill.online_tenant.landlord_id, bill.online_tenant.tenant_id)
+    if not allowed:
+        return HttpResponseForbidden("Not allowed")
+
+    photo = bill.meter_photo_thumbnail if request.GET.get("thumbnail") == "1" else bill.meter_photo
+    if not photo:
+        raise Http404("This bill has no meter photo.")
+    filename = f"meter-{bill.id}{os.path.splitext(photo.name)[1]}"
+    try:
+        return serve_file(request, photo.storage, photo.name, filename,
+                          as_attachment=request.GET.get("download") == "1")
+    except FileNotFoundError:
+        raise Http404("The meter photo file is missing.")
+
+
 @login_required
 @landlord_required
 def delete_document(request, doc_id):
-    doc = get_object_or_404(TenantDocument, id=doc_id)
+    doc = get_object_or_404(TenantDocument.objects.select_related("offline_tenant"), id=doc_id)
 
     # Check permissions: landlord can delete
     if doc.tenant_type == "offline":
-        if doc.offline_tenant.landlord != request.user:
+        if doc.offline_tenant.landlord_id != request.user.id:
             return HttpResponseForbidden("Not allowed")
-        tenant_id = doc.offline_tenant.id
+        tenant_id = doc.offline_tenant_id
         tenant_type = "offline"
     else:  # online tenant
         link_exists = LinkTenantLandlord.objects.filter(
-            tenant=doc.online_tenant, landlord=request.user
+            tenant_id=doc.online_tenant_id, landlord=request.user
         ).exists()
         if not link_exists:
             return HttpResponseForbidden("Not allowed")
-        tenant_id = doc.online_tenant.id
+        tenant_id = doc.online_tenant_id
         tenant_type = "online"
 
     doc.delete()
@@ -743,56 +749,74 @@ def delete_document(request, doc_id):
 
 @login_required
 def all_bills(request):
-    user = request.user
     tenants_filter = request.GET.get("tenant", "")
-    bills = Billing.objects.none()  # default empty queryset
+    cursor = request.GET.get("after")
+    if cursor and decode_cursor(cursor) is None:
+        return HttpResponseBadRequest("Malformed 'after' cursor.")
 
-    if user.role == "landlord":
-        # Offline tenants
-        offline_tenants = OfflineTenants.objects.filter(landlord=user)
-        # Online tenants (links)
-        links = LinkTenantLandlord.objects.filter(landlord=user)
-
-        # Filter bills
-        bills = Billing.objects.filter(
-            Q(offline_tenant__in=offline_tenants) |
-            Q(online_tenant__in=links)
-        )
-
-        # Optional filter by tenant name
-        if tenants_filter:
-            bills = bills.filter(
-                Q(offline_tenant__name__icontains=tenants_filter) |
-                Q(online_tenant__tenant__username__icontains=tenants_filter)
-            )
-
-        bills = bills.order_by("-start_date")
-
-    elif user.role == "tenant":
-        # Only show bills linked to this tenant
-        # Online tenant bills
-        links = LinkTenantLandlord.objects.filter(tenant=user)
-        bills = Billing.objects.filter(
-            Q(online_tenant__in=links)
-        ).order_by("-start_date")
+    bills = bills_for(request.user, tenants_filter)
+    page, next_cursor = keyset_page(bills, cursor, page_size_from(request.GET.get("limit")))
 
     return render(request, "accounts/all_bills.html", {
-        "bills": bills,
+        "bills": page,
+        "totals": bill_totals(bills),
+        "next_cursor": next_cursor,
+        "is_first_page": not cursor,
         "tenants_filter": tenants_filter,
     })
 
 
+@login_required
+def all_bills_json(request):
+    """Paged bill history for the mobile client; follow next_cursor until it is null."""
+    tenants_filter = request.GET.get("tenant", "")
+    cursor = request.GET.get("after")
+    if cursor and decode_cursor(cursor) is None:
+        return JsonResponse({"error": "Malformed 'after' cursor."}, status=400)
+
+    bills = bills_for(request.user, tenants_filter)
+    page, next_cursor = keyset_page(bills, cursor, page_size_from(request.GET.get("limit")))
+
+    data = {
+        "bills": [
+            {
+                "id": bill.id,
+                "tenant_type": "offline" if bill.offline_tenant_id else "online",
+                "tenant_name": (
+                    bill.offline_tenant.name if bill.offline_tenant_id
+                    else bill.online_tenant.tenant.full_name
+                ),
+                "start_date": str(bill.start_date),
+                "end_date": str(bill.end_date),
+                "rent": bill.rent,
+                "meter_bill": bill.meter_amount,
+                "misc_charge": bill.misc_charge,
+                "total": bill.bill_total,
+                "amount_paid": bill.amount_paid,
+                "remaining_due": bill.bill_remaining,
+                "status": bill.status,
+            }
+            for bill in page
+        ],
+        "next_cursor": next_cursor,
+    }
+    # Totals cost an extra aggregate, so only the first page carries them
+    if not cursor:
+        data["totals"] = bill_totals(bills)
+    return JsonResponse(data)
+
+
 @login_required
 def register_as_tenant(request):
     user = request.user
 
     if user.role != "guest":
         messages.warning(request, "You are already registered as a tenant or have another role.")
-        return redirect("tenant_dashboard")  
+        return redirect(dashboard_for(user))
 
     # Promote guest to tenant
     user.role = "tenant"
-    user.save()
+    user.save(update_fields=["role"])
 
     messages.success(request, "You have been registered as a tenant!")
     return redirect("tenant_dashboard")
@@ -2,6 +2,9 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn config.asgi:application``) so the
+chat long-poll view (accounts.views.wait_for_messages) waits without holding a
+worker thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -14,3 +17,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Daily billing runs in server processes only. Leader election happens per
+# run through the DB lease, so it is safe for every worker to start its loop.
+from accounts.scheduler import start_scheduler  # noqa: E402
+
+start_scheduler()
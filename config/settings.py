@@ -4,9 +4,15 @@ import os
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings profile: "dev" (default) or "performance" for a device or server
+# that should serve real traffic. DJANGO_DEBUG=1/0 overrides either way.
+PROFILE = os.environ.get("DJANGO_PROFILE", "dev")
+PERFORMANCE = PROFILE == "performance"
+
 # Security & debug
 SECRET_KEY = 'dev-secret-key'  # You can keep a static key for offline use
-DEBUG = True  # Always True for mobile offline
+# DEBUG also keeps every executed query in memory, so it is off for performance
+DEBUG = os.environ.get("DJANGO_DEBUG", "0" if PERFORMANCE else "1") == "1"
 
 ALLOWED_HOSTS = ['*']  # Allow all hosts for offline/local use
 
@@ -24,15 +30,16 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    'accounts.middleware.QueryProfilingMiddleware',  # Off unless SQL_PROFILING=1; outermost so it sees every query
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'accounts.middleware.StaticFilesMiddleware',  # WhiteNoise, async-capable so ASGI chains stay async
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'accounts.middleware.RunBillsOnEveryVisitMiddleware',  # Keep if you want daily bills to auto-run
+    'accounts.middleware.BillingWatermarkMiddleware',  # Starts the daily bill run once the date rolls over
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -41,7 +48,7 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
+        'APP_DIRS': not PERFORMANCE,  # Must be off when loaders are listed
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
@@ -52,6 +59,15 @@ TEMPLATES = [
     },
 ]
 
+if PERFORMANCE:
+    # Compile each template once per process, never re-check the files
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'config.wsgi.application'
 
 # Database: SQLite for mobile offline
@@ -62,6 +78,56 @@ DATABASES = {
     }
 }
 
+if PERFORMANCE:
+    DATABASES["default"].update({
+        # Reuse a thread's connection across requests instead of reopening it
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # WAL lets readers run alongside the writer; NORMAL only syncs at
+            # checkpoints, which WAL keeps crash-safe; cache_size is in KiB
+            # when negative (64 MiB per connection)
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA busy_timeout=20000;"
+                "PRAGMA cache_size=-65536;"
+                "PRAGMA temp_store=MEMORY;"
+            ),
+            # Seconds a writer waits for the lock before "database is locked"
+            "timeout": 20,
+            # Take the write lock when a transaction starts, so two atomic
+            # blocks that read then write cannot deadlock on the upgrade
+            "transaction_mode": "IMMEDIATE",
+        },
+    })
+    # Sessions read from the cache, written through to the database; together
+    # with the role-based redirect after login, the dashboard costs one query.
+    # Only with a cache every worker shares (CACHE_DIR): with per-process
+    # memory, a worker could keep serving a session another one changed or
+    # logged out, so sessions stay on the plain database backend.
+    if os.environ.get("CACHE_DIR"):
+        SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# Cache (billing watermark, retry backoff): per-process memory by
+# default, or a directory shared by every worker when CACHE_DIR is set
+if os.environ.get("CACHE_DIR"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ["CACHE_DIR"],
+            "TIMEOUT": 24 * 60 * 60,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "rentkhata",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = []  # Skip validation for offline/mobile convenience
 
@@ -80,13 +146,48 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Django's static serve view is for development: on by default only with DEBUG,
+# as before. SERVE_MEDIA=1 turns it on without DEBUG for a device with no front server.
+SERVE_MEDIA = os.environ.get("SERVE_MEDIA", "1" if DEBUG else "0") == "1"
 
 # User model
 AUTH_USER_MODEL = 'accounts.CustomUser'
+# Log in by username or phone number (one query); see accounts.throttle for lockouts
+AUTHENTICATION_BACKENDS = ['accounts.backends.UsernameOrPhoneBackend']
 LOGOUT_REDIRECT_URL = '/'
 
 # CSRF for local offline
 CSRF_TRUSTED_ORIGINS = ['http://127.0.0.1:8000']
 
+# Daily bill generation thread, started from config.wsgi / config.asgi
+# (see accounts.scheduler.scheduler_enabled)
+BILLING_SCHEDULER_ENABLED = os.environ.get("BILLING_SCHEDULER", "1") != "0"
+
+# Per-request SQL profiling (accounts.middleware.QueryProfilingMiddleware)
+SQL_PROFILING = os.environ.get("SQL_PROFILING") == "1"
+SQL_PROFILING_SLOW_MS = int(os.environ.get("SQL_PROFILING_SLOW_MS", "500"))
+SQL_PROFILING_MAX_QUERIES = int(os.environ.get("SQL_PROFILING_MAX_QUERIES", "50"))
+
+# Directory of the slow request log (accounts.slow_requests); must exist.
+# Defaults to the project root, where the log is git-ignored.
+LOG_DIR = Path(os.environ.get("LOG_DIR", BASE_DIR))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "slow_requests": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": LOG_DIR / "slow_requests.log",
+            "maxBytes": 5 * 1024 * 1024,
+            "backupCount": 3,
+            "delay": True,  # No file until something is slow
+        },
+    },
+    "loggers": {
+        "accounts.slow_requests": {"handlers": ["slow_requests"], "level": "WARNING", "propagate": False},
+    },
+}
+
 # Default primary key field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -15,14 +15,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from django.views.static import serve
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('',include('accounts.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# static() only works with DEBUG on; SERVE_MEDIA follows DEBUG unless set explicitly.
+# Only legacy meter photos are public: documents and content-addressed blobs
+# (which hold both) go through the permission-checked views in accounts.
+if settings.SERVE_MEDIA:
+    urlpatterns += [
+        re_path(
+            r'^%s(?P<path>meter_photos/.*)$' % settings.MEDIA_URL.lstrip('/'),
+            serve, {'document_root': settings.MEDIA_ROOT},
+        ),
+    ]
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Daily billing runs in server processes only. Leader election happens per
+# run through the DB lease, so it is safe for every worker to start its loop.
+from accounts.scheduler import start_scheduler  # noqa: E402
+
+start_scheduler()